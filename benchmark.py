@@ -0,0 +1,332 @@
+# benchmark.py
+# Đo hiệu năng đường chọn clip -> normalize -> concat trên media tổng hợp (lavfi),
+# chạy offline, luôn dùng nhánh CPU/libx264.
+#
+#   python benchmark.py                  # chạy và so với baseline (nếu có)
+#   python benchmark.py --save-baseline  # chạy và lưu kết quả làm baseline mới
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import threading
+import resource
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+BASELINE_FILE = os.path.join(REPO_DIR, "log_data", "benchmark_baseline.json")
+REGRESSION_THRESHOLD = 0.10    # chậm hơn baseline 10% thì báo
+
+# (tên, WxH, fps, tham số video, tham số audio, sample rate, đuôi file)
+CLIP_SPECS = [
+    ("conform_1080p60", "1920x1080", 60,
+     ["-c:v", "libx264", "-profile:v", "main", "-pix_fmt", "yuv420p"], ["-c:a", "aac"], 48000, ".mp4"),
+    ("audio_44k", "1920x1080", 60,
+     ["-c:v", "libx264", "-profile:v", "main", "-pix_fmt", "yuv420p"], ["-c:a", "aac"], 44100, ".mp4"),
+    ("mkv_1080p60", "1920x1080", 60,
+     ["-c:v", "libx264", "-profile:v", "main", "-pix_fmt", "yuv420p"], ["-c:a", "aac"], 48000, ".mkv"),
+    ("hd_720p30", "1280x720", 30,
+     ["-c:v", "libx264", "-profile:v", "high", "-pix_fmt", "yuv420p"], ["-c:a", "aac"], 48000, ".mp4"),
+    ("sd_480p25_mpeg4", "640x480", 25,
+     ["-c:v", "mpeg4", "-q:v", "5"], ["-c:a", "pcm_s16le"], 44100, ".avi"),
+    ("vertical_1080x1920p50", "1080x1920", 50,
+     ["-c:v", "libx264", "-pix_fmt", "yuv420p"], ["-c:a", "aac"], 48000, ".mp4"),
+]
+
+
+def generate_clips(clip_dir, duration):
+    """Sinh các clip test bằng testsrc2 + sine, đủ loại copy / audio / remux / transcode."""
+    os.makedirs(clip_dir, exist_ok=True)
+    paths = []
+    for name, size, fps, video_args, audio_args, sample_rate, ext in CLIP_SPECS:
+        path = os.path.join(clip_dir, name + ext)
+        if not os.path.exists(path):
+            command = [
+                "ffmpeg", "-y", "-v", "error",
+                "-f", "lavfi", "-i", f"testsrc2=size={size}:rate={fps}:duration={duration}",
+                "-f", "lavfi", "-i", f"sine=frequency=440:sample_rate={sample_rate}:duration={duration}",
+                *video_args, "-g", str(fps * 2),
+                *audio_args, "-ar", str(sample_rate),
+                "-shortest", path,
+            ]
+            subprocess.run(command, check=True)
+        paths.append(path)
+    return paths
+
+
+def select_clips(module, clip_paths, seed=0):
+    """Chọn clip qua generate_video_lists như một dòng 'auto' của sheet."""
+    import pandas as pd
+
+    durations = module.np.array([module.get_video_seconds(p) for p in clip_paths], dtype=float)
+    first, rest = clip_paths[0], clip_paths[1:]
+    job = pd.DataFrame([{
+        "first vids": first,
+        "desired length": float(durations.sum()) / 60,
+    }])
+    results, _ = module.generate_video_lists(
+        job, durations[1:], list(rest), set(), num_lists=1, seed=seed, release_used=lambda: []
+    )
+    return results[0]["selected_files"]
+
+
+def children_usage():
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def process_rss():
+    """dict pid -> (ppid, RSS byte) của mọi process, đọc từ /proc (chỉ Linux)."""
+    page = os.sysconf("SC_PAGE_SIZE")
+    result = {}
+    for pid in os.listdir("/proc"):
+        if not pid.isdigit():
+            continue
+        try:
+            with open(f"/proc/{pid}/stat", "rb") as f:
+                # tên process nằm trong (...) và có thể chứa dấu cách: tách sau dấu ) cuối
+                fields = f.read().rsplit(b")", 1)[1].split()
+        except (OSError, IndexError):
+            continue
+        result[int(pid)] = (int(fields[1]), int(fields[21]) * page)
+    return result
+
+
+class RssSampler:
+    """Đỉnh RSS của process lớn nhất (chính nó hoặc một ffmpeg con) trong lúc chạy một scenario.
+
+    ru_maxrss là đỉnh của cả đời process, nên scenario sau luôn thấy đỉnh của scenario trước;
+    ở đây đọc RSS hiện tại của process này và các process con qua /proc mỗi `interval` giây.
+    Không có /proc thì peak_mb là None.
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.peak = 0
+        self.available = os.path.isdir("/proc")
+        self._stop = threading.Event()
+        self._thread = None
+
+    def sample(self):
+        processes = process_rss()
+        tree = {os.getpid()}
+        # process con của process con (ffmpeg chạy qua shell, ...) cũng tính
+        changed = True
+        while changed:
+            changed = False
+            for pid, (ppid, _) in processes.items():
+                if ppid in tree and pid not in tree:
+                    tree.add(pid)
+                    changed = True
+        self.peak = max([self.peak] + [processes[pid][1] for pid in tree if pid in processes])
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.sample()
+
+    def __enter__(self):
+        if self.available:
+            self.sample()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.sample()
+
+    @property
+    def peak_mb(self):
+        return round(self.peak / 1024 ** 2, 1) if self.available else None
+
+
+def check_output(module, output_path, inputs):
+    info = module.probe_video_info(output_path)
+    mode = module.classify_clip(info, output_path)
+    expected = sum(module.get_video_seconds(p) for p in inputs)
+    actual = module.get_video_seconds(output_path)
+    return {
+        "conformant": mode == module.CLIP_COPY,
+        "mode": mode,
+        "duration": round(actual, 3),
+        "duration_error": round(actual - expected, 3),
+    }
+
+
+def run_scenario(module, name, inputs, output_path, **kwargs):
+    written = []
+    job = {}
+
+    def on_record(record):
+        if record.get("stage") in ("normalize", "concat"):
+            written.append(record.get("bytes_out", 0))
+        elif record.get("stage") == "job":
+            job.update(record)
+
+    metrics = module.get_metrics()
+    metrics.add_listener(on_record)
+    cpu_before = children_usage()
+    self_before = time.process_time()
+    start = time.perf_counter()
+    try:
+        with RssSampler() as rss:
+            module.auto_concat(inputs, output_path, **kwargs)
+    finally:
+        metrics.remove_listener(on_record)
+    wall = time.perf_counter() - start
+    cpu_after = children_usage()
+    result = {
+        "scenario": name,
+        "engine": job.get("engine"),
+        "wall_seconds": round(wall, 3),
+        "cpu_seconds": round(cpu_after - cpu_before + time.process_time() - self_before, 3),
+        # đỉnh của process lớn nhất trong scenario này, không phải tổng (xem RssSampler)
+        "peak_rss_mb": rss.peak_mb,
+        "bytes_written": sum(written),
+        **check_output(module, output_path, inputs),
+    }
+    os.remove(output_path)
+    return result
+
+
+# engine=None: để auto_concat tự chọn giữa segment và filtergraph (xem pick_concat_engine)
+# các scenario *_cache_warm dùng cache do segments_cache_cold vừa tạo
+SCENARIOS = [
+    ("segments", {"use_cache": False, "engine": "segments"}),
+    ("segments_cache_cold", {"use_cache": True, "engine": "segments"}),
+    ("segments_cache_warm", {"use_cache": True, "engine": "segments"}),
+    ("auto_cache_warm", {"use_cache": True, "engine": None}),
+    ("streaming", {"use_cache": False, "streaming": True}),
+    ("filtergraph", {"use_cache": False, "engine": "filtergraph"}),
+    ("auto", {"use_cache": False, "engine": None}),
+]
+
+
+def run_benchmark(workdir, duration=6, repeat=1, only=None):
+    # cô lập cache, index, log, metrics trong workdir; không dùng NVENC
+    os.environ["CONCAT_USE_NVENC"] = "0"
+    os.environ["CONCAT_CACHE_DIR"] = os.path.join(workdir, "cache")
+    os.environ["CONCAT_SCRATCH_DIR"] = os.path.join(workdir, "scratch")
+    os.chdir(workdir)
+    import module
+
+    clip_paths = generate_clips(os.path.join(workdir, "clips"), duration)
+    inputs = select_clips(module, clip_paths)
+    output = os.path.join(workdir, "out.mp4")
+    results = []
+    for name, kwargs in SCENARIOS:
+        if only and name not in only:
+            continue
+        runs = []
+        for _ in range(repeat):
+            if name == "segments_cache_cold":
+                shutil.rmtree(os.environ["CONCAT_CACHE_DIR"], ignore_errors=True)
+                module._clip_cache = None
+            runs.append(run_scenario(module, name, inputs, output, channel="benchmark", **kwargs))
+        # lấy lần chạy có wall time trung vị
+        runs.sort(key=lambda r: r["wall_seconds"])
+        results.append(runs[len(runs) // 2])
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "host": platform.node(),
+        "cpu_count": os.cpu_count(),
+        "ffmpeg": ffmpeg_version(),
+        "clip_seconds": duration,
+        "clips": [os.path.basename(p) for p in inputs],
+        "results": results,
+    }
+
+
+def ffmpeg_version():
+    try:
+        out = subprocess.run(["ffmpeg", "-version"], capture_output=True, text=True).stdout
+        return out.splitlines()[0] if out else ""
+    except OSError:
+        return ""
+
+
+def compare(report, baseline, threshold=REGRESSION_THRESHOLD):
+    """In chênh lệch so với baseline, trả về danh sách scenario bị chậm đi."""
+    if baseline.get("clip_seconds") != report["clip_seconds"] or baseline.get("cpu_count") != report["cpu_count"]:
+        print("[WARN] Baseline được đo với cấu hình khác (clip_seconds / cpu_count), so sánh chỉ mang tính tham khảo.")
+    old = {r["scenario"]: r for r in baseline.get("results", [])}
+    regressions = []
+    for r in report["results"]:
+        b = old.get(r["scenario"])
+        if not b:
+            continue
+        for key in ("wall_seconds", "cpu_seconds", "peak_rss_mb", "bytes_written"):
+            if b.get(key) and r.get(key) is not None:
+                delta = (r[key] - b[key]) / b[key]
+                print(f"  {r['scenario']:<22} {key:<14} {b[key]:>12} -> {r[key]:>12} ({delta:+.1%})")
+                if key == "wall_seconds" and delta > threshold:
+                    regressions.append(r["scenario"])
+        if b.get("conformant") and not r["conformant"]:
+            regressions.append(r["scenario"])
+    return regressions
+
+
+def print_report(report):
+    print(f"\n{report['ffmpeg']} | {report['cpu_count']} CPU | {len(report['clips'])} clip x {report['clip_seconds']}s")
+    for r in report["results"]:
+        status = "OK" if r["conformant"] else f"NOT CONFORMANT ({r['mode']})"
+        rss = "-" if r["peak_rss_mb"] is None else f"{r['peak_rss_mb']:.1f}"
+        print(
+            f"  {r['scenario']:<22} wall {r['wall_seconds']:>7.2f}s  cpu {r['cpu_seconds']:>7.2f}s  "
+            f"rss {rss:>7}MB  written {r['bytes_written'] / 1024 ** 2:>7.1f}MB  "
+            f"dur {r['duration']:.2f}s ({r['duration_error']:+.2f})  {r.get('engine') or '-':<11} {status}"
+        )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark pipeline normalize + concat (CPU/libx264)")
+    parser.add_argument("--duration", type=int, default=6, help="độ dài mỗi clip test (giây)")
+    parser.add_argument("--repeat", type=int, default=1, help="số lần chạy mỗi scenario (lấy trung vị)")
+    parser.add_argument("--scenario", action="append", choices=[name for name, _ in SCENARIOS],
+                        help="chỉ chạy scenario này (lặp lại để chọn nhiều)")
+    parser.add_argument("--baseline", default=BASELINE_FILE)
+    parser.add_argument("--save-baseline", action="store_true")
+    parser.add_argument("--workdir", help="thư mục làm việc (mặc định: thư mục tạm, xoá khi xong)")
+    args = parser.parse_args(argv)
+
+    if not shutil.which("ffmpeg") or not shutil.which("ffprobe"):
+        print("Cần ffmpeg và ffprobe trong PATH.")
+        return 2
+
+    baseline_path = os.path.abspath(args.baseline)
+    workdir = os.path.abspath(args.workdir) if args.workdir else tempfile.mkdtemp(prefix="concat_bench_")
+    os.makedirs(workdir, exist_ok=True)
+    cwd = os.getcwd()
+    try:
+        report = run_benchmark(workdir, args.duration, max(1, args.repeat), args.scenario)
+    finally:
+        os.chdir(cwd)
+        if not args.workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print_report(report)
+    regressions = []
+    if os.path.exists(baseline_path) and not args.save_baseline:
+        with open(baseline_path, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nSo với baseline {baseline.get('created')}:")
+        regressions = compare(report, baseline)
+    if args.save_baseline:
+        os.makedirs(os.path.dirname(baseline_path), exist_ok=True)
+        with open(baseline_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\nĐã lưu baseline: {baseline_path}")
+    if regressions:
+        print(f"\n[REGRESSION] {', '.join(dict.fromkeys(regressions))}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,142 @@
+# channel_job.py
+# Một lượt xử lý của một kênh: đọc các dòng 'auto' trong worksheet, chọn clip, ghép output,
+# cập nhật sheet. Cấu hình kênh lấy từ channels.toml (xem channels.py).
+from module import *
+from channels import get_channel
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+
+
+def authorize(creds_file):
+    creds = Credentials.from_service_account_file(creds_file, scopes=SCOPES)
+    return gspread.authorize(creds)
+
+
+def write_mapping_log(mapping_log, output_path, inputs):
+    os.makedirs(os.path.dirname(mapping_log), exist_ok=True)
+    with open(mapping_log, "a", encoding="utf-8") as f:
+        f.write("\n==============================\n")
+        f.write(f"OUTPUT: {output_path}\n")
+        f.write("INPUTS:\n")
+        for p in inputs:
+            f.write(f"{p}\n")
+        f.write("\n==============================\n")
+
+
+def run_channel(channel, gc=None, worksheet=None, values=None):
+    """Chạy một lượt cho kênh, trả về số output đã ghép.
+
+    Một output lỗi (clip cố định hỏng, hết ổ, ...) chỉ được ghi log + metric; các dòng
+    còn lại của kênh vẫn chạy, dòng lỗi giữ status 'auto' để lượt sau thử lại.
+
+    gc: client gspread dùng chung (loop.py); None thì tự authorize.
+    worksheet / values: worksheet và nội dung đã đọc sẵn bằng batch (SpreadsheetSnapshot).
+    Tối đa channel.concurrency output của kênh được ghép cùng lúc.
+    """
+    if isinstance(channel, str):
+        channel = get_channel(channel)
+    name = channel.name
+    try:
+        if worksheet is None:
+            if gc is None:
+                gc = authorize(channel.creds_file)
+            worksheet = gc.open(channel.sheet_name).get_worksheet(channel.sheet_index)
+        journal = channel_journal(name)
+        if pending_sheet_rows(journal):
+            flush_pending_updates(worksheet, journal)
+            # values đọc trước khi flush: dòng vừa ghi 'Done' vẫn còn là 'auto'
+            values = None
+    except Exception as e:
+        print(f"Error in main execution: {e}")
+        return 0
+    try:
+        suitable_df, original_df = load_job_table(worksheet, values)
+        if suitable_df.empty:
+            print("No suitable data found for processing (status='auto' with non-null 'first vids' and 'desired length').")
+            return 0
+        durations, file_paths, csv_df = prepare_original_data(channel.csv_file)
+        if csv_df is None:
+            print("Failed to load data from CSV. Exiting.")
+            return 0
+        used_store = UsedVideoStore(name, legacy_log=channel.used_log)
+        results, newly_used_paths = generate_video_lists(
+            suitable_df=suitable_df,
+            durations=durations,
+            file_paths=file_paths,
+            used_video_paths=used_store.paths(),
+            num_lists=1,
+            release_used=lambda: used_store.reuse_pool(file_paths)
+        )
+        if not results:
+            print("No video lists generated.")
+            return 0
+        format_and_print_results(results)
+    except KeyError as e:
+        print(f"Error: Missing column {e} in the sheet.")
+        return 0
+    except Exception as e:
+        print(f"Unexpected error: {str(e)}")
+        return 0
+
+    # kênh ưu tiên cao được nhiều slot CPU hơn khi các kênh cùng encode
+    get_encode_scheduler().set_priority(name, channel.priority)
+
+    # Bước 3: Ghép video + cập nhật Google Sheet
+    sheet_sink = SheetSink(worksheet, journal=journal)
+    lock = threading.Lock()
+    done = []
+
+    def produce(k, ls):
+        try:
+            produce_row(k, ls)
+            done.append(k)
+        except Exception as e:
+            row_index = suitable_df.index[ls['group_index']]
+            print(f"[ERR] Kênh {name}, dòng {row_index + 2} ({ls['name']}): {e}")
+            get_metrics().record("output_failed", channel=name, row=int(row_index) + 2,
+                                 name=str(ls['name']), error=str(e))
+
+    def produce_row(k, ls):
+        output_path = os.path.join(channel.output_dir, f"{get_file_name(ls['name'])}_{name}.mp4")
+        row_index = suitable_df.index[ls['group_index']]
+        # output sẽ bắt đầu khi output này xong: copy trước clip của nó
+        following = k + channel.concurrency
+        # checkpoint theo dòng sheet: chạy lại sau crash không mất phần đã encode
+        checkpoint = job_checkpoint(name, row_index + 2, ls['name'])
+        ls['selected_files'] = produce_output(
+            ls['selected_files'], output_path, name, used_store, checkpoint,
+            substitute=ls['substitute'], fixed=ls['fixed'], profile=channel.profile,
+            upcoming=results[following]['selected_files'] if following < len(results) else ()
+        )
+        with lock:
+            write_mapping_log(channel.mapping_log, output_path, ls['selected_files'])
+
+            current_value = original_df.at[row_index, 'output directory']
+            if pd.isna(current_value) or str(current_value).strip().lower() == 'nan' or current_value == "":
+                original_df.at[row_index, 'output directory'] = output_path
+            else:
+                original_df.at[row_index, 'output directory'] = f"{current_value}\n{output_path}"
+
+            original_df.at[row_index, 'status'] = 'Done'
+            #Cập nhật Google Sheet (ghi journal trước, flush theo batch)
+            sheet_sink.update_row(row_index, original_df.loc[row_index])
+        checkpoint.finish()
+
+    try:
+        if channel.concurrency == 1:
+            for k, ls in enumerate(results):
+                produce(k, ls)
+        else:
+            with ThreadPoolExecutor(max_workers=channel.concurrency) as executor:
+                for future in [executor.submit(produce, k, ls) for k, ls in enumerate(results)]:
+                    future.result()
+    finally:
+        try:
+            sheet_sink.close()
+            print("Updated Google Sheet.")
+        except Exception as e:
+            print(f"Error updating Google Sheet: {e}")
+    return len(done)
@@ -0,0 +1,74 @@
+import os
+
+try:
+    import tomllib
+except ImportError:     # Python < 3.11
+    import tomli as tomllib
+
+CHANNELS_FILE = os.environ.get(
+    "CONCAT_CHANNELS_FILE", os.path.join(os.path.dirname(os.path.abspath(__file__)), "channels.toml")
+)
+# các tham số của normalize_video được phép đặt trong [profiles.<tên>]
+PROFILE_KEYS = {"use_nvenc", "cq", "v_bitrate", "a_bitrate"}
+
+
+class Channel:
+    """Cấu hình một kênh (một worksheet của sheet Concat) đọc từ channels.toml."""
+
+    def __init__(self, config, defaults, profiles):
+        merged = {**defaults, **config}
+        self.name = merged["name"]
+        self.title = merged.get("title", self.name)
+        self.sheet_name = merged["sheet_name"]
+        self.sheet_index = int(merged["sheet_index"])
+        self.creds_file = merged["creds_file"]
+        self.library = merged.get("library", self.name)
+        self.library_dirs = list(merged.get("library_dirs", []))
+        self.csv_file = merged.get("csv_file", os.path.join("csv_data", f"{self.library}.csv"))
+        self.output_dir = merged["output_dir"]
+        # file log cũ (mỗi dòng một path), chỉ dùng để nạp used store lần đầu
+        self.used_log = merged.get("used_log", os.path.join("log_data", f"{self.name}.log"))
+        self.mapping_log = merged.get("mapping_log", os.path.join("log_data", "mapping_log", f"{self.name.lower()}.log"))
+        self.priority = float(merged.get("priority", 1.0))
+        self.concurrency = max(1, int(merged.get("concurrency", 1)))
+        profile_name = merged.get("profile", "default")
+        if profile_name not in profiles:
+            raise ValueError(f"Kênh {self.name}: không có profile '{profile_name}' trong [profiles]")
+        self.profile_name = profile_name
+        self.profile = dict(profiles[profile_name])
+        unknown = set(self.profile) - PROFILE_KEYS
+        if unknown:
+            raise ValueError(f"Profile '{profile_name}': tham số không hỗ trợ {sorted(unknown)}")
+
+    def __repr__(self):
+        return f"Channel({self.name!r}, sheet_index={self.sheet_index})"
+
+
+def load_channels(path=CHANNELS_FILE):
+    """Danh sách Channel theo thứ tự trong file."""
+    with open(path, "rb") as f:
+        data = tomllib.load(f)
+    defaults = data.get("defaults", {})
+    profiles = data.get("profiles", {"default": {}})
+    channels = [Channel(c, defaults, profiles) for c in data.get("channel", [])]
+    names = [c.name for c in channels]
+    duplicates = {n for n in names if names.count(n) > 1}
+    if duplicates:
+        raise ValueError(f"Trùng tên kênh trong {path}: {sorted(duplicates)}")
+    return channels
+
+
+def get_channel(name, path=CHANNELS_FILE):
+    for channel in load_channels(path):
+        if name in (channel.name, channel.title):
+            return channel
+    raise KeyError(f"Không có kênh '{name}' trong {path}")
+
+
+def library_jobs(channels=None):
+    """[(library, [thư mục, ...])] cho csv_data/get_data.py; kênh dùng chung thư viện chỉ quét một lần."""
+    jobs = {}
+    for channel in channels if channels is not None else load_channels():
+        dirs = jobs.setdefault(channel.library, [])
+        dirs.extend(d for d in channel.library_dirs if d not in dirs)
+    return list(jobs.items())
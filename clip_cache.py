@@ -0,0 +1,127 @@
+import os
+import re
+import json
+import uuid
+import hashlib
+import threading
+
+# === Cấu hình cache clip đã normalize ===
+CACHE_DIR = os.environ.get("CONCAT_CACHE_DIR", os.path.join("cache", "normalized"))
+CACHE_MAX_GB = float(os.environ.get("CONCAT_CACHE_MAX_GB", "200"))
+
+_ENTRY_RE = re.compile(r"^[0-9a-f]{40}\.\w+$")
+
+
+def cache_key(input_path, params):
+    """Key = đường dẫn nguồn + size + mtime + tham số normalize."""
+    st = os.stat(input_path)
+    payload = json.dumps({
+        "path": os.path.abspath(input_path),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+        "params": params,
+    }, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(payload.encode("utf-8")).hexdigest()
+
+
+class NormalizedClipCache:
+    """Cache trên đĩa cho output của normalize_video, giới hạn dung lượng và xoá theo LRU.
+
+    Mỗi entry là một file `<key>.<ext>`; lần dùng gần nhất được ghi vào mtime của file.
+    Các entry đang được job dùng (pin) sẽ không bị xoá khi evict.
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=int(CACHE_MAX_GB * 1024 ** 3)):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        os.makedirs(cache_dir, exist_ok=True)
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._pinned = {}
+
+    def _entry_path(self, key, ext):
+        return os.path.join(self.cache_dir, f"{key}{ext}")
+
+    def _key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    def pin(self, path):
+        with self._lock:
+            self._pinned[path] = self._pinned.get(path, 0) + 1
+
+    def unpin(self, path):
+        with self._lock:
+            count = self._pinned.get(path, 0) - 1
+            if count > 0:
+                self._pinned[path] = count
+            else:
+                self._pinned.pop(path, None)
+
+    def lookup(self, input_path, params, ext=".mp4"):
+        """Trả về đường dẫn entry nếu đã có trong cache (và cập nhật LRU), ngược lại None."""
+        path = self._entry_path(cache_key(input_path, params), ext)
+        try:
+            os.utime(path, None)
+        except FileNotFoundError:
+            return None
+        return path
+
+    def get_or_create(self, input_path, params, produce, ext=".mp4"):
+        """Lấy entry từ cache, nếu chưa có thì gọi produce(tmp_path) để tạo.
+
+        Trả về (path, hit). Entry trả về đã được pin, caller phải unpin() khi dùng xong.
+        """
+        key = cache_key(input_path, params)
+        path = self._entry_path(key, ext)
+        with self._key_lock(key):
+            hit = os.path.exists(path)
+            if hit:
+                os.utime(path, None)
+            else:
+                tmp_path = os.path.join(self.cache_dir, f".{key}.{uuid.uuid4().hex}{ext}")
+                try:
+                    produce(tmp_path)
+                    os.replace(tmp_path, path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+            self.pin(path)
+        if not hit:
+            self.evict()
+        return path, hit
+
+    def entries(self):
+        result = []
+        for name in os.listdir(self.cache_dir):
+            if not _ENTRY_RE.match(name):
+                continue
+            path = os.path.join(self.cache_dir, name)
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            result.append((st.st_mtime, st.st_size, path))
+        return result
+
+    def total_bytes(self):
+        return sum(size for _, size, _ in self.entries())
+
+    def evict(self):
+        """Xoá các entry cũ nhất cho tới khi tổng dung lượng <= max_bytes."""
+        with self._lock:
+            entries = sorted(self.entries())
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in entries:
+                if total <= self.max_bytes:
+                    break
+                if path in self._pinned:
+                    continue
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+        return removed
@@ -0,0 +1,123 @@
+import numpy as np
+
+
+class ClipSampler:
+    """Chọn clip ngẫu nhiên không lặp lại từ thư viện.
+
+    Các index chưa dùng được xáo trộn một lần thành một hoán vị, mỗi lần rút chỉ
+    tăng con trỏ (O(1)). Cùng `seed` sẽ cho cùng kết quả.
+    """
+
+    def __init__(self, durations, file_paths, used_paths=(), seed=None, on_exhausted=None):
+        self.durations = np.asarray(durations, dtype=np.float64)
+        self.file_paths = file_paths
+        self.rng = np.random.default_rng(seed)
+        # on_exhausted() trả về các path được dùng lại khi hết clip (None = toàn bộ thư viện)
+        self.on_exhausted = on_exhausted
+        self.resets = 0
+        used = used_paths if isinstance(used_paths, (set, frozenset)) else set(used_paths)
+        available = np.fromiter((p not in used for p in file_paths), dtype=bool, count=len(file_paths))
+        self._shuffle(np.flatnonzero(available))
+
+    def _shuffle(self, indexes):
+        self._order = self.rng.permutation(np.asarray(indexes, dtype=np.int64))
+        self._pos = 0
+
+    def remaining(self):
+        return len(self._order) - self._pos
+
+    def _refill(self):
+        if not len(self.file_paths):
+            return False
+        paths = self.on_exhausted() if self.on_exhausted else None
+        if paths is None:
+            indexes = np.arange(len(self.file_paths))
+        else:
+            wanted = set(paths)
+            indexes = [i for i, p in enumerate(self.file_paths) if p in wanted]
+        self.resets += 1
+        self._shuffle(indexes)
+        return self.remaining() > 0
+
+    def _take(self, offset=0):
+        """Lấy phần tử ở vị trí con trỏ + offset (đổi chỗ lên đầu rồi tăng con trỏ)."""
+        i = self._pos + offset
+        self._order[self._pos], self._order[i] = self._order[i], self._order[self._pos]
+        index = int(self._order[self._pos])
+        self._pos += 1
+        return index
+
+    def draw(self, exclude=()):
+        """Rút một index chưa dùng, bỏ qua các path trong `exclude`. Hết clip thì trả về None."""
+        refilled = False
+        while True:
+            if not self.remaining():
+                if refilled or not self._refill():
+                    return None
+                refilled = True
+            index = self._take()
+            if self.file_paths[index] not in exclude:
+                return index
+
+    def fill(self, target, total=0.0, exclude=(), fit=False, tolerance=30.0, lookahead=256):
+        """Rút clip cho tới khi tổng thời lượng đạt `target` (giây).
+
+        Mặc định giống cách cũ: thêm cho tới khi >= target (có thể vượt tối đa một clip).
+        Với fit=True, các clip cuối được chọn trong `lookahead` ứng viên kế tiếp sao cho
+        tổng nằm trong khoảng target ± tolerance nếu có thể.
+        Trả về (danh sách index, tổng thời lượng).
+        """
+        exclude = set(exclude)
+        picked = []
+        max_resets = self.resets + 1
+        while total < target:
+            remaining = target - total
+            if fit and remaining <= tolerance:
+                break
+            if not self.remaining() and (self.resets >= max_resets or not self._refill()):
+                break
+            if fit:
+                window = self.durations[self._order[self._pos:self._pos + lookahead]]
+                closes = np.flatnonzero(np.abs(window - remaining) <= tolerance)
+                fits = np.flatnonzero(window <= remaining - tolerance)
+                if len(closes):
+                    offset = int(closes[0])
+                elif len(fits):
+                    offset = int(fits[0])
+                else:
+                    offset = int(np.argmin(np.abs(window - remaining)))
+                index = self._take(offset)
+                if self.file_paths[index] in exclude:
+                    continue
+            else:
+                index = self.draw(exclude)
+                if index is None:
+                    break
+            picked.append(index)
+            exclude.add(self.file_paths[index])
+            total += float(self.durations[index])
+        return picked, total
+
+    def substitute(self, duration, exclude=(), lookahead=256):
+        """Rút một clip chưa dùng có thời lượng gần `duration` nhất (thay cho clip hỏng).
+
+        Chỉ xét `lookahead` ứng viên kế tiếp của hoán vị nên vẫn giữ tính ngẫu nhiên.
+        Hết clip thì trả về None.
+        """
+        exclude = set(exclude)
+        refilled = False
+        while True:
+            if not self.remaining():
+                if refilled or not self._refill():
+                    return None
+                refilled = True
+            candidates = self._order[self._pos:self._pos + lookahead]
+            allowed = np.fromiter((self.file_paths[i] not in exclude for i in candidates),
+                                  dtype=bool, count=len(candidates))
+            if not allowed.any():
+                # cả cửa sổ đều bị loại: bỏ qua và xét cửa sổ tiếp theo
+                for _ in range(len(candidates)):
+                    self._take()
+                continue
+            gaps = np.where(allowed, np.abs(self.durations[candidates] - duration), np.inf)
+            return self._take(int(np.argmin(gaps)))
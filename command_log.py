@@ -0,0 +1,144 @@
+import os
+import re
+import gzip
+import json
+import shutil
+import threading
+from datetime import datetime, timedelta
+
+LOG_DIR = os.path.join("log_data", "logs")
+LOG_MAX_BYTES = int(os.environ.get("CONCAT_LOG_MAX_MB", 20)) * 1024 ** 2   # file trong ngày lớn hơn thì xoay
+LOG_KEEP_DAYS = int(os.environ.get("CONCAT_LOG_KEEP_DAYS", 0))             # 0 = giữ mãi (mặc định)
+STDERR_TAIL_CHARS = 4000
+# <ngày>.jsonl, <ngày>.<n>.jsonl (phần đã xoay), có thể kèm .gz; <ngày>.log là log text kiểu cũ
+LOG_NAME = re.compile(r"^(\d{4}-\d{2}-\d{2})(?:\.(\d+))?\.(jsonl|log)(\.gz)?$")
+
+
+def command_io(cmd):
+    """(các input -i, output) của một lệnh ffmpeg/ffprobe."""
+    inputs = [cmd[i + 1] for i, arg in enumerate(cmd[:-1]) if arg == "-i"]
+    output = cmd[-1] if cmd and os.path.splitext(os.path.basename(cmd[0]))[0] == "ffmpeg" else None
+    return inputs, output
+
+
+def gzip_file(path):
+    # ghi ra file tạm rồi mới đổi tên: hai process cùng dọn một thư mục không tạo ra .gz hỏng
+    tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        with open(path, "rb") as fin, gzip.open(tmp, "wb") as fout:
+            shutil.copyfileobj(fin, fout)
+        os.replace(tmp, path + ".gz")
+        os.remove(path)
+    except FileNotFoundError:
+        pass    # process khác đã nén xong
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+class CommandLog:
+    """Log JSON-lines, mỗi lệnh một dòng: argv, exit code, thời gian, stderr (chỉ khi lỗi).
+
+    File theo ngày trong `directory`; quá `max_bytes` thì xoay sang <ngày>.<n>.jsonl.
+    Phần đã xoay và các ngày cũ được nén gzip ở thread nền. Mặc định không xoá gì; đặt
+    `keep_days` (CONCAT_LOG_KEEP_DAYS) thì file .jsonl quá chừng đó ngày bị xoá. Log text
+    kiểu cũ (<ngày>.log) chỉ được nén, không bao giờ bị xoá.
+    Đọc lại bằng log_query.py.
+    """
+
+    def __init__(self, directory=LOG_DIR, max_bytes=LOG_MAX_BYTES, keep_days=LOG_KEEP_DAYS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.keep_days = keep_days
+        self._lock = threading.Lock()
+        self._compress_lock = threading.Lock()
+        self._day = None
+
+    def path(self, day=None):
+        return os.path.join(self.directory, f"{day or datetime.now().strftime('%Y-%m-%d')}.jsonl")
+
+    def write(self, kind, **fields):
+        record = {"ts": datetime.now().isoformat(timespec="seconds"), "kind": kind, **fields}
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        day = record["ts"][:10]
+        with self._lock:
+            if day != self._day:
+                os.makedirs(self.directory, exist_ok=True)
+                self._day = day
+                self._start_housekeeping()
+            path = self.path(day)
+            if self.max_bytes and os.path.exists(path) and os.path.getsize(path) + len(line) > self.max_bytes:
+                self._rotate(path, day)
+            with open(path, "a", encoding="utf-8") as f:
+                f.write(line)
+        return record
+
+    def command(self, cmd, returncode, seconds, stage=None, tags=None, stderr=None, timeout=False):
+        """Record của một lệnh; stderr (các dòng cuối) chỉ được giữ khi lệnh lỗi."""
+        inputs, output = command_io(cmd)
+        fields = {
+            "stage": stage,
+            "exit": returncode,
+            "seconds": round(seconds, 3),
+            "argv": list(cmd),
+            "inputs": inputs,
+            "output": output,
+            **(tags or {}),
+        }
+        if timeout:
+            fields["timeout"] = True
+        if (returncode != 0 or timeout) and stderr:
+            fields["stderr"] = stderr[-STDERR_TAIL_CHARS:]
+        return self.write("command", **fields)
+
+    def _rotate(self, path, day):
+        n = 1
+        while any(os.path.exists(os.path.join(self.directory, f"{day}.{n}.jsonl{ext}")) for ext in ("", ".gz")):
+            n += 1
+        rotated = os.path.join(self.directory, f"{day}.{n}.jsonl")
+        os.replace(path, rotated)
+        threading.Thread(target=self._compress, args=([rotated],), daemon=True).start()
+
+    def _start_housekeeping(self):
+        threading.Thread(target=self.housekeeping, daemon=True).start()
+
+    def housekeeping(self, today=None):
+        """Nén file của các ngày trước, xoá file .jsonl quá keep_days (nếu keep_days > 0)."""
+        today = today or datetime.now().strftime('%Y-%m-%d')
+        cutoff = (datetime.strptime(today, '%Y-%m-%d') - timedelta(days=self.keep_days)).strftime('%Y-%m-%d')
+        to_compress = []
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            match = LOG_NAME.match(name)
+            if not match:
+                continue
+            day, part, kind, gz = match.groups()
+            path = os.path.join(self.directory, name)
+            if self.keep_days and kind == "jsonl" and day < cutoff:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            elif not gz and (day < today or part):
+                to_compress.append(path)
+        self._compress(to_compress)
+
+    def _compress(self, paths):
+        with self._compress_lock:
+            for path in paths:
+                if not os.path.exists(path):
+                    continue
+                try:
+                    gzip_file(path)
+                except OSError as e:
+                    print(f"[WARN] Không nén được log {path}: {e}")
+
+
+_command_log = CommandLog()
+
+
+def get_command_log():
+    return _command_log
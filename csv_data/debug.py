@@ -1,19 +1,23 @@
-import subprocess
+import os
+import sys
 import pandas as pd
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from probe import get_probe_service
+
 def get_format_profile(video_path):
     try:
-        # Gọi ffprobe để lấy thông tin format profile
-        result = subprocess.run(
-            ['ffprobe', '-v', 'error', '-select_streams', 'v:0',
-             '-show_entries', 'format=format_name:stream=codec_name,profile',
-             '-of', 'default=noprint_wrappers=1:nokey=0',
-             video_path],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        return result.stdout.strip()
+        # Lấy thông tin format profile từ probe service (có cache)
+        info = get_probe_service().probe(video_path)
+        if info is None:
+            raise RuntimeError("ffprobe không đọc được file")
+        video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), {})
+        lines = [
+            f"codec_name={video.get('codec_name', '')}",
+            f"profile={video.get('profile', '')}",
+            f"format_name={info.get('format', {}).get('format_name', '')}",
+        ]
+        return "\n".join(lines)
     except Exception as e:
         return f"Lỗi: {str(e)}"
 
@@ -26,7 +30,8 @@ def main():
         print("Không tìm thấy cột 'file_path' trong file CSV.")
         return
 
-    # Lặp qua từng video path
+    # Probe song song toàn bộ trước, sau đó in theo thứ tự
+    get_probe_service().probe_many(df['file_path'].astype(str).tolist())
     for index, row in df.iterrows():
         path = row['file_path']
         print(f"File: {path}")
@@ -1,22 +1,19 @@
 import os
+import sys
 import pandas as pd
-import subprocess
-import json
 from datetime import datetime
-from concurrent.futures import ThreadPoolExecutor, as_completed
 
-JOBS = [
-    ("Number", [r"E:\Number A\Video", r"E:\Number B\Video", r"E:\Number SLime\Video", r"E:\Number TC\Video", r"E:\Rainbow Number\Video"]),
-    ("Tractor", [r"D:\Video"]),
-    ("Thomas", [r"F:\Thomas"]),
-    ("Doll", [r"F:\Doll\Video"]),
-    ("Lolipop", [r"\\MINGSEO2\Khay den"])
-]
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from library_index import LibraryIndex, stream_summary
+from probe import get_probe_service
+from channels import library_jobs
 
 VIDEO_EXTENSIONS = {'.mp4', '.avi', '.mkv', '.mov'}
 CSV_OUTPUT_DIR = "csv_data"
 MIN_DURATION_SECONDS = 60
 MAX_WORKERS = 8
+CSV_COLUMNS = ["stt", "file_path", "duration", "duration_sec",
+               "vcodec", "profile", "width", "height", "fps", "acodec", "sample_rate"]
 
 os.makedirs(CSV_OUTPUT_DIR, exist_ok=True)
 
@@ -35,36 +32,18 @@ def get_file_list(folder_path, extensions=None):
         print(f"[ERR] Error accessing folder '{folder_path}': {e}")
         return []
 
+def probe_video(file_path):
+    return get_probe_service().probe(file_path)
+
 def get_video_duration_seconds(file_path):
-    try:
-        cmd = [
-            "ffprobe", "-v", "error",
-            "-show_entries", "format=duration",
-            "-of", "json", file_path
-        ]
-        result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
-        data = json.loads(result.stdout or "{}")
-        return float(data.get("format", {}).get("duration", 0.0))
-    except Exception:
-        return 0.0
+    return get_probe_service().duration(file_path)
 
 def format_duration(seconds):
     minute = int(seconds // 60)
     sec = int(seconds % 60)
     return f"{minute}:{sec:02d}"
 
-def is_valid_video(file_path):
-    """Trả về True nếu video >= MIN_DURATION_SECONDS."""
-    return get_video_duration_seconds(file_path) >= MIN_DURATION_SECONDS
-
-def process_video(file_path, stt):
-    duration_sec = get_video_duration_seconds(file_path)
-    if duration_sec < MIN_DURATION_SECONDS:
-        return None
-    duration = format_duration(duration_sec)
-    return [stt, file_path, duration]
-
-def run_one_job(csv_name, folder_paths):
+def run_one_job(csv_name, folder_paths, index):
     print(f"\n=== Job: {csv_name} ===")
     all_videos = []
     for path in folder_paths:
@@ -76,63 +55,61 @@ def run_one_job(csv_name, folder_paths):
         print("[INFO] No videos found.")
         return
 
-    # === Đếm số video hợp lệ (>=60s) ===
-    valid_count = 0
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(is_valid_video, fp): fp for fp in all_videos}
-        for future in as_completed(futures):
-            if future.result():
-                valid_count += 1
+    # === Chỉ probe file mới / đã thay đổi ===
+    stats = index.sync(csv_name, all_videos, probe_video, roots=folder_paths, max_workers=MAX_WORKERS)
+    print(f"[INFO] Index: {stats['new']} new, {stats['changed']} changed, "
+          f"{stats['removed']} removed, {stats['unchanged']} unchanged, {stats['failed']} probe failed")
 
-    output_file = os.path.join(CSV_OUTPUT_DIR, f"{csv_name}.csv")
+    # === Xuất CSV từ index (chỉ các file đang thấy được) ===
+    listed = set(all_videos)
+    clips = [c for c in index.clips(csv_name, MIN_DURATION_SECONDS) if c[0] in listed]
+    if not clips:
+        print("[INFO] No valid videos to save.")
+        return
+    clips.sort(key=lambda c: os.path.basename(c[0]).lower())
+    # duration giữ dạng m:ss cho người đọc; duration_sec là số giây chính xác
+    df = pd.DataFrame(
+        [
+            {"stt": i + 1, "file_path": p, "duration": format_duration(d), "duration_sec": round(d, 3),
+             **stream_summary(info)}
+            for i, (p, d, info) in enumerate(clips)
+        ],
+        columns=CSV_COLUMNS,
+    )
 
-    # === Kiểm tra nếu CSV cũ có cùng số lượng hợp lệ ===
+    output_file = os.path.join(CSV_OUTPUT_DIR, f"{csv_name}.csv")
+    content = df.to_csv(index=False)
     if os.path.exists(output_file):
         try:
-            old_df = pd.read_csv(output_file)
-            old_count = len(old_df)
-            if old_count == valid_count:
-                print(f"[SKIP] {csv_name}: same valid count ({valid_count} videos).")
-                return
-            else:
-                print(f"[INFO] Valid count changed: old={old_count}, new={valid_count}. Updating...")
+            with open(output_file, "r", encoding="utf-8-sig", newline="") as f:
+                if f.read() == content:
+                    print(f"[SKIP] {csv_name}: unchanged ({len(df)} videos).")
+                    return
         except Exception as e:
             print(f"[WARN] Cannot read old CSV ({e}), will rebuild.")
 
-    # === Thực sự xử lý và lưu CSV ===
-    all_videos.sort(key=lambda p: os.path.basename(p).lower())
-    results = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        futures = {executor.submit(process_video, fp, i+1): fp for i, fp in enumerate(all_videos)}
-        for idx, future in enumerate(as_completed(futures), 1):
-            fp = futures[future]
-            try:
-                row = future.result()
-                if row:
-                    results.append(row)
-                    print(f"{idx}: {row[1]}")
-                else:
-                    print(f"{idx}: Skipped (<{MIN_DURATION_SECONDS}s): {fp}")
-            except Exception as e:
-                print(f"[ERR] {fp}: {e}")
-
-    if results:
-        df = pd.DataFrame(results, columns=["stt", "file_path", "duration"])
-        df.to_csv(output_file, index=False, encoding="utf-8-sig")
-        print(f"[DONE] Saved to {output_file} ({len(df)} valid videos)")
-    else:
-        print("[INFO] No valid videos to save.")
+    # ghi file tạm rồi replace để kênh đang đọc CSV không thấy file ghi dở
+    tmp_file = output_file + ".tmp"
+    with open(tmp_file, "w", encoding="utf-8-sig", newline="") as f:
+        f.write(content)
+    os.replace(tmp_file, output_file)
+    print(f"[DONE] Saved to {output_file} ({len(df)} valid videos)")
 
 def main():
-    print("=== Video → CSV (Skip if same valid count) ===")
-    for csv_name, paths in JOBS:
-        if isinstance(paths, str):
-            paths = [paths]
-        valid_paths = [p for p in paths if os.path.isdir(p)]
-        if not valid_paths:
-            print(f"[SKIP] Invalid paths for {csv_name}: {paths}")
-            continue
-        run_one_job(csv_name, valid_paths)
+    print("=== Video → CSV (incremental probe index) ===")
+    index = LibraryIndex()
+    try:
+        # thư viện của các kênh trong channels.toml
+        for csv_name, paths in library_jobs():
+            if isinstance(paths, str):
+                paths = [paths]
+            valid_paths = [p for p in paths if os.path.isdir(p)]
+            if not valid_paths:
+                print(f"[SKIP] Invalid paths for {csv_name}: {paths}")
+                continue
+            run_one_job(csv_name, valid_paths, index)
+    finally:
+        index.close()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,109 @@
+import os
+import threading
+import itertools
+from contextlib import contextmanager
+
+# === Cấu hình pool encode dùng chung ===
+CPU_CORES = int(os.environ.get("CONCAT_CPU_CORES", os.cpu_count() or 4))
+# số thread truyền cho ffmpeg (-threads) và cũng là số slot CPU mà job giữ
+ENCODER_THREADS = {
+    "libx264": 4,
+    "h264_nvenc": 2,   # GPU encode, CPU chỉ decode + scale
+    "copy": 1,         # remux / concat stream copy
+    "aac": 1,          # encode riêng audio (chunked encode)
+}
+# giới hạn số job chạy cùng lúc theo encoder (NVENC giới hạn số session)
+ENCODER_MAX_JOBS = {
+    "h264_nvenc": 5,
+}
+
+
+class EncodeScheduler:
+    """Pool slot CPU dùng chung cho mọi ffmpeg job của tất cả các kênh.
+
+    Mỗi job giữ `threads` slot trong khi chạy. Khi có nhiều job chờ, job đầu hàng của
+    kênh đang giữ ít slot nhất (chia theo priority) được vào trước, nên kênh chậm không
+    chặn kênh khác và máy không bị oversubscribe. Trong một kênh, job có `cost` lớn
+    nhất đứng đầu hàng (longest-first), cùng cost thì theo thứ tự đến. `cost` chỉ là key
+    xếp hàng: output streaming truyền chi phí còn lại từ clip tới hết playlist, để clip
+    đầu playlist (mux đang chờ) vào trước.
+    """
+
+    def __init__(self, total_slots=CPU_CORES, max_jobs=None):
+        self.total = max(1, total_slots)
+        self.free = self.total
+        self.max_jobs = dict(ENCODER_MAX_JOBS if max_jobs is None else max_jobs)
+        self.priority = {}
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._waiting = []          # (seq, channel, encoder, threads, cost)
+        self._channel_slots = {}
+        self._encoder_jobs = {}
+
+    def threads_for(self, encoder):
+        return min(ENCODER_THREADS.get(encoder, 1), self.total)
+
+    def set_priority(self, channel, priority):
+        with self._cond:
+            self.priority[channel] = max(priority, 1e-6)
+            self._cond.notify_all()
+
+    def _share(self, channel):
+        return self._channel_slots.get(channel, 0) / self.priority.get(channel, 1.0)
+
+    def _encoder_full(self, encoder):
+        limit = self.max_jobs.get(encoder)
+        return limit is not None and self._encoder_jobs.get(encoder, 0) >= limit
+
+    def _next_ticket(self):
+        heads = {}
+        for ticket in self._waiting:
+            head = heads.get(ticket[1])
+            if head is None or ticket[4] > head[4]:
+                heads[ticket[1]] = ticket
+        # job đang chờ session encoder thì nhường lượt, không giữ chỗ slot CPU
+        ready = [t for t in heads.values() if not self._encoder_full(t[2])]
+        if not ready:
+            return None
+        return min(ready, key=lambda t: (self._share(t[1]), t[0]))
+
+    def acquire(self, channel, encoder, threads=None, cost=0):
+        threads = min(threads or self.threads_for(encoder), self.total)
+        ticket = (next(self._seq), channel, encoder, threads, cost)
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while not (self._next_ticket() is ticket and self.free >= threads):
+                    self._cond.wait()
+            finally:
+                self._waiting.remove(ticket)
+            self.free -= threads
+            self._channel_slots[channel] = self._channel_slots.get(channel, 0) + threads
+            self._encoder_jobs[encoder] = self._encoder_jobs.get(encoder, 0) + 1
+            self._cond.notify_all()
+        return threads
+
+    def release(self, channel, encoder, threads):
+        with self._cond:
+            self.free += threads
+            self._channel_slots[channel] -= threads
+            self._encoder_jobs[encoder] -= 1
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, channel, encoder, threads=None, cost=0):
+        """with scheduler.slot(kenh, encoder) as threads: chạy ffmpeg với -threads threads"""
+        threads = self.acquire(channel, encoder, threads, cost)
+        try:
+            yield threads
+        finally:
+            self.release(channel, encoder, threads)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "total": self.total,
+                "free": self.free,
+                "waiting": len(self._waiting),
+                "channels": dict(self._channel_slots),
+            }
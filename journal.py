@@ -0,0 +1,148 @@
+import os
+import json
+import threading
+from datetime import datetime
+
+JOURNAL_DIR = os.path.join("log_data", "journal")
+
+
+class Journal:
+    """File JSON-lines chỉ ghi nối thêm, dùng để khôi phục sau khi process bị dừng giữa chừng.
+
+    Mỗi dòng là một event {"ts": ..., "event": ..., ...}. Dòng cuối ghi dở (crash
+    giữa lúc ghi) sẽ bị bỏ qua khi đọc lại.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self._lock = threading.Lock()
+
+    def append(self, event, **fields):
+        record = {"ts": datetime.now().isoformat(timespec="seconds"), "event": event, **fields}
+        line = json.dumps(record, ensure_ascii=False) + "\n"
+        with self._lock:
+            with open(self.path, "a", encoding="utf-8") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+    def events(self):
+        if not os.path.exists(self.path):
+            return []
+        result = []
+        with self._lock:
+            with open(self.path, "r", encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        result.append(json.loads(line))
+                    except ValueError:
+                        continue
+        return result
+
+    def rewrite(self, records):
+        """Ghi lại journal chỉ với các record còn cần (thay file một cách atomic)."""
+        tmp_path = self.path + ".tmp"
+        with self._lock:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                for record in records:
+                    f.write(json.dumps(record, ensure_ascii=False) + "\n")
+            os.replace(tmp_path, self.path)
+
+    def clear(self):
+        self.rewrite([])
+
+
+def channel_journal(channel):
+    return Journal(os.path.join(JOURNAL_DIR, f"{channel}.jsonl"))
+
+
+def pending_sheet_rows(journal):
+    """Các update dòng sheet đã ghi vào journal nhưng chưa flush lên Google Sheet."""
+    pending = {}
+    for record in journal.events():
+        if record.get("event") == "row":
+            pending[record["row"]] = record["values"]
+        elif record.get("event") == "flushed":
+            for row in record.get("rows", []):
+                pending.pop(row, None)
+    return pending
+
+
+class JobCheckpoint:
+    """Checkpoint của một output (một dòng sheet): clip đã chọn (và clip thay thế),
+    segment đã normalize xong, output cuối và việc đã ghi trạng thái used.
+
+    Chạy lại sau khi crash: dùng lại đúng danh sách clip đã chọn, segment đã xong lấy lại
+    từ cache, output đã ghép xong thì không ghép lại. Journal bị xoá khi output hoàn tất.
+    """
+
+    def __init__(self, journal, name=None):
+        self.journal = journal
+        self.name = name
+        self.selected = None
+        self.output = None
+        self.used = False
+        self.segments = {}
+        for record in journal.events():
+            event = record.get("event")
+            if event == "selected":
+                self.selected = record
+            elif event == "replaced" and self.selected:
+                self.selected["files"][record["index"]] = record["path"]
+            elif event == "segment":
+                self.segments[record["index"]] = record["path"]
+            elif event == "output":
+                self.output = record["path"]
+            elif event == "used":
+                self.used = True
+        if self.selected and name is not None and self.selected.get("name") != name:
+            # dòng sheet đã đổi nội dung: checkpoint cũ không còn đúng
+            self.reset()
+
+    def reset(self):
+        self.journal.clear()
+        self.selected, self.output, self.used, self.segments = None, None, False, {}
+
+    def select(self, files, output_path):
+        """Danh sách clip của output: lấy lại từ lần chạy trước nếu còn đủ file."""
+        if self.selected and all(os.path.exists(p) for p in self.selected["files"]):
+            print(f"[RESUME] {output_path}: dùng lại {len(self.selected['files'])} clip đã chọn, "
+                  f"{len(self.segments)} segment đã xong")
+            return list(self.selected["files"])
+        self.reset()
+        self.journal.append("selected", name=self.name, output=output_path, files=list(files))
+        self.selected = {"files": list(files)}
+        return list(files)
+
+    def replace_clip(self, index, path):
+        """Clip ở vị trí index bị hỏng và đã được thay bằng path."""
+        if self.selected:
+            self.selected["files"][index] = path
+        self.journal.append("replaced", index=index, path=path)
+
+    def segment_done(self, index, path):
+        self.segments[index] = path
+        self.journal.append("segment", index=index, path=path)
+
+    def output_ready(self):
+        return self.output is not None and os.path.exists(self.output)
+
+    def output_done(self, path):
+        self.output = path
+        self.journal.append("output", path=path)
+
+    def used_done(self):
+        self.used = True
+        self.journal.append("used")
+
+    def finish(self):
+        try:
+            os.remove(self.journal.path)
+        except FileNotFoundError:
+            pass
+
+
+def job_checkpoint(channel, gs_row, name=None):
+    return JobCheckpoint(Journal(os.path.join(JOURNAL_DIR, "jobs", channel, f"row{gs_row}.jsonl")), name)
@@ -0,0 +1,197 @@
+import os
+import json
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+INDEX_DB = os.path.join("csv_data", "library_index.db")
+
+
+def stat_signature(path):
+    st = os.stat(path)
+    return st.st_size, st.st_mtime_ns
+
+
+def stream_summary(info):
+    """Các thông số chính của clip lấy từ JSON ffprobe (dùng cho cột CSV / bảng clip)."""
+    streams = info.get("streams", [])
+    video = next((s for s in streams if s.get("codec_type") == "video"), {})
+    audio = next((s for s in streams if s.get("codec_type") == "audio"), {})
+    num, _, den = str(video.get("avg_frame_rate") or "0/1").partition("/")
+    try:
+        fps = round(float(num) / float(den or 1), 3)
+    except (ValueError, ZeroDivisionError):
+        fps = 0.0
+    return {
+        "vcodec": video.get("codec_name", ""),
+        "profile": video.get("profile", ""),
+        "width": video.get("width", 0),
+        "height": video.get("height", 0),
+        "fps": fps,
+        "acodec": audio.get("codec_name", ""),
+        "sample_rate": int(audio.get("sample_rate", 0) or 0),
+    }
+
+
+class LibraryIndex:
+    """Index SQLite của thư viện video: path -> size/mtime + kết quả ffprobe.
+
+    Khi quét lại chỉ probe file mới hoặc đã thay đổi, file biến mất thì xoá khỏi index.
+    Clip bị đánh dấu hỏng (quarantine) không được chọn nữa cho tới khi file thay đổi.
+    """
+
+    def __init__(self, db_path=INDEX_DB):
+        self.db_path = db_path
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS clips (
+                path TEXT PRIMARY KEY,
+                library TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                duration REAL NOT NULL DEFAULT 0,
+                info TEXT,
+                probed_at REAL,
+                quarantined TEXT
+            )
+        """)
+        columns = {row[1] for row in self.conn.execute("PRAGMA table_info(clips)")}
+        if "quarantined" not in columns:
+            self.conn.execute("ALTER TABLE clips ADD COLUMN quarantined TEXT")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_clips_library ON clips(library)")
+        self.conn.commit()
+
+    def close(self):
+        self.conn.close()
+
+    def _signatures(self, library):
+        """(path -> (size, mtime_ns), các path chưa có kết quả probe)."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path, size, mtime_ns, info FROM clips WHERE library = ?", (library,)
+            ).fetchall()
+        return ({path: (size, mtime_ns) for path, size, mtime_ns, _ in rows},
+                {path for path, _, _, info in rows if not json.loads(info or "{}")})
+
+    def lookup(self, path, size, mtime_ns):
+        """JSON ffprobe đã lưu nếu file chưa thay đổi (cùng size + mtime), ngược lại None.
+
+        Entry rỗng (probe lỗi do phiên bản cũ lưu vào, hoặc chỉ có cờ quarantine) coi như chưa probe.
+        """
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT info FROM clips WHERE path = ? AND size = ? AND mtime_ns = ?",
+                (path, size, mtime_ns),
+            ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0] or "{}") or None
+
+    def upsert(self, library, path, size, mtime_ns, info):
+        """library='' : file ngoài thư viện (giữ nguyên library nếu path đã có trong index)."""
+        duration = float(info.get("format", {}).get("duration", 0.0) or 0.0)
+        with self._lock:
+            self.conn.execute(
+                """
+                INSERT INTO clips (path, library, size, mtime_ns, duration, info, probed_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET
+                    library = CASE WHEN excluded.library = '' THEN clips.library ELSE excluded.library END,
+                    size = excluded.size, mtime_ns = excluded.mtime_ns,
+                    duration = excluded.duration, info = excluded.info, probed_at = excluded.probed_at,
+                    quarantined = NULL
+                """,
+                (path, library, size, mtime_ns, duration, json.dumps(info, ensure_ascii=False), time.time()),
+            )
+            self.conn.commit()
+
+    def quarantine(self, path, reason):
+        """Đánh dấu clip hỏng. Bỏ đánh dấu tự động khi file thay đổi (được probe lại)."""
+        try:
+            size, mtime_ns = stat_signature(path)
+        except OSError:
+            size, mtime_ns = -1, -1
+        with self._lock:
+            self.conn.execute(
+                """
+                INSERT INTO clips (path, library, size, mtime_ns, duration, info, probed_at, quarantined)
+                VALUES (?, '', ?, ?, 0, NULL, ?, ?)
+                ON CONFLICT(path) DO UPDATE SET quarantined = excluded.quarantined
+                """,
+                (path, size, mtime_ns, time.time(), reason or "unknown"),
+            )
+            self.conn.commit()
+
+    def is_quarantined(self, path):
+        with self._lock:
+            row = self.conn.execute("SELECT quarantined FROM clips WHERE path = ?", (path,)).fetchone()
+        return row is not None and row[0] is not None
+
+    def quarantined(self):
+        """dict path -> lý do, các clip đang bị đánh dấu hỏng."""
+        with self._lock:
+            rows = self.conn.execute("SELECT path, quarantined FROM clips WHERE quarantined IS NOT NULL")
+            return dict(rows.fetchall())
+
+    def sync(self, library, file_paths, probe, roots=None, max_workers=8):
+        """Đồng bộ index với danh sách file hiện có.
+
+        probe(path) trả về JSON của ffprobe, None (hoặc raise) nếu probe lỗi: file đó không
+        được ghi vào index, lần quét sau probe lại. Chỉ xoá các entry nằm trong `roots`
+        (các thư mục đã quét được) để share tạm mất kết nối không làm mất index.
+        """
+        known, unprobed = self._signatures(library)
+        current = {}
+        to_probe = []
+        for path in file_paths:
+            try:
+                sig = stat_signature(path)
+            except OSError:
+                continue
+            current[path] = sig
+            if known.get(path) != sig or path in unprobed:
+                to_probe.append(path)
+
+        stats = {"new": 0, "changed": 0, "removed": 0, "failed": 0, "unchanged": len(current) - len(to_probe)}
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            futures = {executor.submit(probe, path): path for path in to_probe}
+            for future in as_completed(futures):
+                path = futures[future]
+                try:
+                    info = future.result()
+                except Exception as e:
+                    print(f"[ERR] probe {path}: {e}")
+                    info = None
+                if info is None:
+                    # giữ nguyên entry cũ (nếu có): probe lỗi tạm thời không làm clip thành 0 giây
+                    stats["failed"] += 1
+                    continue
+                stats["changed" if path in known else "new"] += 1
+                self.upsert(library, path, *current[path], info)
+
+        prefixes = tuple(os.path.join(os.path.abspath(r), "") for r in (roots or []))
+        vanished = [
+            p for p in known
+            if p not in current and (not prefixes or p.startswith(prefixes))
+        ]
+        if vanished:
+            with self._lock:
+                self.conn.executemany("DELETE FROM clips WHERE path = ?", [(p,) for p in vanished])
+                self.conn.commit()
+        stats["removed"] = len(vanished)
+        return stats
+
+    def clips(self, library, min_duration=0.0):
+        """Danh sách (path, duration, info) của thư viện, lọc theo thời lượng tối thiểu."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path, duration, info FROM clips "
+                "WHERE library = ? AND duration >= ? AND quarantined IS NULL",
+                (library, min_duration),
+            ).fetchall()
+        return [(path, duration, json.loads(info or "{}")) for path, duration, info in rows]
@@ -1,8 +1,20 @@
-from pymediainfo import MediaInfo
+import os
+import sys
 import pandas as pd
 from pathlib import Path
 
-def extract_mediainfo(video_path):
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from probe import get_probe_service
+from module import parse_frame_rate
+
+def _format_duration(seconds):
+    seconds = int(float(seconds or 0))
+    return f"{seconds // 3600}:{seconds // 60 % 60:02d}:{seconds % 60:02d}"
+
+def _kbps(bit_rate):
+    return f"{int(bit_rate) // 1000} kb/s" if str(bit_rate or "").isdigit() else ""
+
+def extract_mediainfo(video_path, probe=None):
     info = {
         "path": str(video_path),
         "duration": "",
@@ -23,27 +35,30 @@ def extract_mediainfo(video_path):
         "channels": "",
     }
 
-    media_info = MediaInfo.parse(video_path)
-    for track in media_info.tracks:
-        if track.track_type == "General":
-            info["format"] = track.format
-            info["format_profile"] = track.format_profile or ""
-            info["duration"] = track.other_duration[0] if track.other_duration else ""
-            info["bit_rate"] = track.other_overall_bit_rate[0] if track.other_overall_bit_rate else ""
-            info["video_size_MB"] = track.other_file_size[0] if track.other_file_size else ""
-        elif track.track_type == "Video":
-            info["codec"] = track.codec_id
-            info["resolution"] = f"{track.width}x{track.height}"
-            info["aspect_ratio"] = track.display_aspect_ratio
-            info["frame_rate"] = track.frame_rate
-            info["scan_type"] = track.scan_type
-            info["bit_depth"] = f"{track.bit_depth} bits" if track.bit_depth else ""
-            info["chroma_subsampling"] = track.chroma_subsampling
-        elif track.track_type == "Audio":
-            info["audio_codec"] = track.codec_id
-            info["audio_bitrate"] = track.other_bit_rate[0] if track.other_bit_rate else ""
-            info["audio_sampling_rate"] = track.other_sampling_rate[0] if track.other_sampling_rate else ""
-            info["channels"] = track.channel_s
+    data = probe if probe is not None else get_probe_service().probe(str(video_path))
+    if not data:
+        raise RuntimeError("ffprobe không đọc được file")
+    fmt = data.get("format", {})
+    info["format"] = fmt.get("format_long_name", "")
+    info["format_profile"] = fmt.get("tags", {}).get("major_brand", "")
+    info["duration"] = _format_duration(fmt.get("duration"))
+    info["bit_rate"] = _kbps(fmt.get("bit_rate"))
+    if str(fmt.get("size", "")).isdigit():
+        info["video_size_MB"] = f"{int(fmt['size']) / 1024 ** 2:.1f} MiB"
+    for track in data.get("streams", []):
+        if track.get("codec_type") == "video" and not info["codec"]:
+            info["codec"] = track.get("codec_tag_string") or track.get("codec_name", "")
+            info["resolution"] = f"{track.get('width')}x{track.get('height')}"
+            info["aspect_ratio"] = track.get("display_aspect_ratio", "")
+            info["frame_rate"] = f"{parse_frame_rate(track.get('avg_frame_rate')):.3f}"
+            info["scan_type"] = track.get("field_order", "")
+            info["bit_depth"] = f"{track['bits_per_raw_sample']} bits" if track.get("bits_per_raw_sample") else ""
+            info["chroma_subsampling"] = track.get("pix_fmt", "")
+        elif track.get("codec_type") == "audio" and not info["audio_codec"]:
+            info["audio_codec"] = track.get("codec_tag_string") or track.get("codec_name", "")
+            info["audio_bitrate"] = _kbps(track.get("bit_rate"))
+            info["audio_sampling_rate"] = f"{track.get('sample_rate', '')} Hz"
+            info["channels"] = track.get("channels", "")
 
     return info
 
@@ -53,19 +68,22 @@ def process_log_file(log_file_path, output_csv="video_full_info.csv"):
         print(f"Không tìm thấy file log: {log_file}")
         return
 
-    results = []
     with open(log_file, 'r', encoding='utf-8') as f:
-        for line in f:
-            path = line.strip()
-            if path and Path(path).exists():
-                print(f"Đang xử lý: {path}")
-                try:
-                    info = extract_mediainfo(path)
-                    results.append(info)
-                except Exception as e:
-                    results.append({"path": path, "error": str(e)})
-            else:
-                results.append({"path": path, "error": "File không tồn tại"})
+        paths = [line.strip() for line in f]
+
+    # probe song song một lượt, kết quả dùng lại từ cache
+    probes = get_probe_service().probe_many([p for p in paths if p and Path(p).exists()])
+    results = []
+    for path in paths:
+        if path and Path(path).exists():
+            print(f"Đang xử lý: {path}")
+            try:
+                info = extract_mediainfo(path, probes.get(path))
+                results.append(info)
+            except Exception as e:
+                results.append({"path": path, "error": str(e)})
+        else:
+            results.append({"path": path, "error": "File không tồn tại"})
 
     df = pd.DataFrame(results)
     df.to_csv(output_csv, index=False, encoding='utf-8-sig')
@@ -0,0 +1,111 @@
+# log_query.py
+# Tra cứu command log (log_data/logs/<ngày>.jsonl, kể cả phần đã xoay / nén .gz).
+#
+#   python log_query.py --failed                    # lệnh lỗi hôm nay
+#   python log_query.py --days 7 --slow 600         # lệnh chạy quá 10 phút trong 7 ngày
+#   python log_query.py --channel Tractor --input "Khay den" --failed
+#   python log_query.py --date 2026-10-01 --stage normalize --top 20
+import os
+import sys
+import gzip
+import json
+import argparse
+from datetime import datetime, timedelta
+
+from command_log import LOG_DIR, LOG_NAME
+
+
+def log_files(directory, days):
+    """Các file .jsonl / .jsonl.gz của các ngày trong `days`, theo thứ tự thời gian."""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    files = []
+    for name in names:
+        match = LOG_NAME.match(name)
+        if match and match.group(3) == "jsonl" and match.group(1) in days:
+            # phần đã xoay (<ngày>.<n>) ghi trước file hiện tại của ngày
+            files.append((match.group(1), int(match.group(2) or 1 << 30), os.path.join(directory, name)))
+    return [path for _, _, path in sorted(files)]
+
+
+def read_records(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8") as f:
+        for line in f:
+            try:
+                yield json.loads(line)
+            except ValueError:
+                continue    # dòng ghi dở khi process bị kill
+
+
+def matches(record, args):
+    if record.get("kind") != "command":
+        return args.all_kinds
+    if args.failed and record.get("exit") == 0 and not record.get("timeout"):
+        return False
+    if args.slow is not None and (record.get("seconds") or 0) < args.slow:
+        return False
+    if args.channel and str(record.get("channel")) != args.channel:
+        return False
+    if args.stage and record.get("stage") != args.stage:
+        return False
+    if args.input:
+        needle = args.input.lower()
+        paths = [*record.get("inputs", []), record.get("clip") or "", record.get("output") or ""]
+        if not any(needle in str(p).lower() for p in paths):
+            return False
+    return True
+
+
+def format_record(record):
+    if record.get("kind") != "command":
+        return f"{record['ts']}  [{record.get('kind')}] " + json.dumps(
+            {k: v for k, v in record.items() if k not in ("ts", "kind")}, ensure_ascii=False)[:300]
+    status = "TIMEOUT" if record.get("timeout") else f"exit {record.get('exit')}"
+    target = record.get("clip") or (record.get("inputs") or [""])[0]
+    lines = [
+        f"{record['ts']}  {record.get('stage') or '-':<9} {status:<8} {record.get('seconds', 0):>8.1f}s  "
+        f"{record.get('channel') or '-':<10} {target}"
+    ]
+    if record.get("exit") != 0 and record.get("stderr"):
+        lines += ["    " + line for line in record["stderr"].rstrip().splitlines()[-5:]]
+    return "\n".join(lines)
+
+
+def date_range(args):
+    end = datetime.strptime(args.date, "%Y-%m-%d") if args.date else datetime.now()
+    return {(end - timedelta(days=i)).strftime("%Y-%m-%d") for i in range(max(1, args.days))}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tra cứu command log của pipeline concat")
+    parser.add_argument("--date", help="ngày YYYY-MM-DD (mặc định hôm nay)")
+    parser.add_argument("--days", type=int, default=1, help="số ngày tính lùi từ --date")
+    parser.add_argument("--failed", action="store_true", help="chỉ lệnh lỗi / bị timeout")
+    parser.add_argument("--slow", type=float, metavar="SECONDS", help="chỉ lệnh chạy lâu hơn SECONDS giây")
+    parser.add_argument("--channel")
+    parser.add_argument("--stage", help="normalize / concat / stitch / ...")
+    parser.add_argument("--input", help="một phần đường dẫn clip input/output (không phân biệt hoa thường)")
+    parser.add_argument("--top", type=int, help="chỉ N lệnh lâu nhất")
+    parser.add_argument("--all-kinds", action="store_true", help="kèm các record không phải lệnh (error, probe_info)")
+    parser.add_argument("--json", action="store_true", help="in nguyên record JSON")
+    parser.add_argument("--dir", default=LOG_DIR)
+    args = parser.parse_args(argv)
+
+    records = [
+        r for path in log_files(args.dir, date_range(args))
+        for r in read_records(path) if matches(r, args)
+    ]
+    if args.top:
+        records = sorted(records, key=lambda r: r.get("seconds") or 0, reverse=True)[:args.top]
+    for record in records:
+        print(json.dumps(record, ensure_ascii=False) if args.json else format_record(record))
+    if not args.json:
+        print(f"\n{len(records)} record")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
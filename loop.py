@@ -1,54 +1,168 @@
 # auto_runner.py
+# Một process chạy liên tục: import thư viện + authorize Google Sheet một lần,
+# sau đó lập lịch quét thư viện và từng kênh như các job riêng.
 import time
-import subprocess
-import pandas as pd
-
-
-while True:
-    try:
-        subprocess.run(["python", "csv_data\get_data.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-    time.sleep(30)
-
-    ############ 1 ##############
-    print("Running tuan_number.py ...")
-    
-    try:
-        subprocess.run(["python", "tuan_number.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-    time.sleep(30)
-    ############ 2 ##############
-
-    print("Running tuan_tractor.py ...")
-    try:
-        subprocess.run(["python", "tuan_tractor.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-    time.sleep(30)
-    
-    ############ 3 ##############
-    print("Running tuan_lolipop_asmr.py ...")
-    try:
-        subprocess.run(["python", "tuan_loli_pop.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-    time.sleep(30)
-    
-    ############ 4 ##############
-    print("Running tuan_mini_toys_world.py ...")
-    try:
-        subprocess.run(["python", "tuan_mini_toys_world.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-    time.sleep(30)
-    
-    ############ 5 ##############
-    print("Running tuan_thomas.py ...")
-    try:
-        subprocess.run(["python", "tuan_thomas.py"], check=True)
-    except subprocess.CalledProcessError as e:
-        print(f"Error: {e}")
-    time.sleep(30)
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
 
+from module import *
+from csv_data import get_data
+from channels import load_channels
+from channel_job import authorize, run_channel
+from sheet_batch import SpreadsheetSnapshot
+
+CREDS_FILE = "sheet.json"
+
+SCAN_INTERVAL = 10 * 60     # quét lại thư viện video mỗi 10 phút
+MIN_IDLE = 30               # kênh không có việc: chờ 30s, 60s, 120s, ...
+MAX_IDLE = 15 * 60          # ... tối đa 15 phút
+# số kênh chạy song song; các encode của mọi kênh dùng chung encode scheduler.
+CHANNEL_WORKERS = 5
+
+
+_cond = threading.Condition()
+_wake_requested = False
+
+
+def wake():
+    """Đánh thức vòng lặp sớm (ví dụ khi có dòng 'auto' mới)."""
+    global _wake_requested
+    with _cond:
+        _wake_requested = True
+        _cond.notify_all()
+
+
+class Job:
+    def __init__(self, name, run, interval=None, is_channel=True):
+        self.name = name
+        self.run = run
+        self.interval = interval    # None = dùng backoff theo kết quả
+        self.is_channel = is_channel
+        self.idle = MIN_IDLE
+        self.next_run = 0.0
+        self.running = False
+
+    def schedule(self, did_work):
+        if self.interval is not None:
+            delay = self.interval
+        elif did_work:
+            self.idle = MIN_IDLE
+            delay = 0
+        else:
+            delay = self.idle
+            self.idle = min(self.idle * 2, MAX_IDLE)
+        self.next_run = time.monotonic() + delay
+
+
+class Orchestrator:
+    def __init__(self, channels=None):
+        self.gc = None
+        # mọi kênh trong một process: dùng chung client sheet, cache, probe và encode scheduler
+        self.channels = load_channels() if channels is None else channels
+        self.jobs = [Job("scan library", self.scan_library, interval=SCAN_INTERVAL, is_channel=False)]
+        # mỗi spreadsheet đọc một lần (batch mọi worksheet của các kênh) cho cả vòng
+        self.snapshots = {}
+        for channel in self.channels:
+            if channel.sheet_name not in self.snapshots:
+                indexes = [c.sheet_index for c in self.channels if c.sheet_name == channel.sheet_name]
+                self.snapshots[channel.sheet_name] = SpreadsheetSnapshot(
+                    lambda name=channel.sheet_name: self.client().open(name), indexes
+                )
+        scheduler = get_encode_scheduler()
+        for channel in self.channels:
+            scheduler.set_priority(channel.name, channel.priority)
+            self.jobs.append(Job(channel.title, self.channel_runner(channel)))
+
+    def client(self):
+        with _cond:
+            return self._client()
+
+    def _client(self):
+        if self.gc is None:
+            self.gc = authorize(self.channels[0].creds_file if self.channels else CREDS_FILE)
+        return self.gc
+
+    def scan_library(self):
+        get_data.main()
+        return True
+
+    def channel_runner(self, channel):
+        snapshot = self.snapshots[channel.sheet_name]
+
+        def run():
+            # không có dòng 'auto': bỏ qua luôn, không đọc CSV thư viện, không probe
+            if not snapshot.has_auto(channel.sheet_index):
+                print(f"[SKIP] {channel.title}: không có dòng 'auto'")
+                return False
+            done = run_channel(channel, worksheet=snapshot.worksheet(channel.sheet_index),
+                               values=snapshot.values(channel.sheet_index))
+            if done:
+                # kênh vừa ghi 'Done' lên sheet: vòng sau phải đọc lại
+                snapshot.invalidate()
+            return done > 0
+        return run
+
+    def run_job(self, job):
+        print(f"\n>>> [{datetime.now().strftime('%H:%M:%S')}] Running {job.name} ...")
+        did_work = False
+        try:
+            did_work = bool(job.run())
+        except Exception as e:
+            print(f"Error in {job.name}: {e}")
+            traceback.print_exc()
+            # lỗi xác thực/kết nối: authorize và mở lại spreadsheet ở lần chạy sau
+            self.gc = None
+            for snapshot in self.snapshots.values():
+                snapshot.reset()
+        with _cond:
+            job.schedule(did_work)
+            job.running = False
+            _cond.notify_all()
+
+    def wake_all(self):
+        for snapshot in self.snapshots.values():
+            snapshot.invalidate()
+        for job in self.jobs:
+            if job.interval is None:
+                job.idle = MIN_IDLE
+                job.next_run = 0.0
+
+    def due_jobs(self, now):
+        running_channels = sum(1 for j in self.jobs if j.running and j.is_channel)
+        due = []
+        for job in sorted(self.jobs, key=lambda j: j.next_run):
+            if job.running or job.next_run > now:
+                continue
+            if job.is_channel:
+                if running_channels >= CHANNEL_WORKERS:
+                    continue
+                running_channels += 1
+            due.append(job)
+        return due
+
+    def run_forever(self):
+        global _wake_requested
+        with ThreadPoolExecutor(max_workers=CHANNEL_WORKERS + 1) as executor:
+            while True:
+                with _cond:
+                    if _wake_requested:
+                        _wake_requested = False
+                        self.wake_all()
+                    now = time.monotonic()
+                    due = self.due_jobs(now)
+                    for job in due:
+                        job.running = True
+                        executor.submit(self.run_job, job)
+                    if due:
+                        continue
+                    idle = [j for j in self.jobs if not j.running]
+                    delay = min(j.next_run for j in idle) - now if idle else None
+                    if delay is not None and delay > 0 and not any(j.running for j in self.jobs):
+                        print(f"Idle {delay:.0f}s (next: {min(idle, key=lambda j: j.next_run).name})")
+                    # delay <= 0: có job tới hạn nhưng đang đủ số kênh chạy -> chờ job xong
+                    _cond.wait(timeout=delay if delay is not None and delay > 0 else None)
+
+
+if __name__ == '__main__':
+    Orchestrator().run_forever()
@@ -0,0 +1,111 @@
+import os
+import json
+import time
+import threading
+from datetime import datetime
+from contextlib import contextmanager
+
+METRICS_DIR = os.path.join("log_data", "metrics")
+
+
+def parse_speed(value):
+    """'1.52x' -> 1.52 (ffmpeg ghi 'N/A' khi chưa tính được)."""
+    try:
+        return float(str(value).strip().rstrip("x"))
+    except ValueError:
+        return None
+
+
+class ProgressParser:
+    """Đọc output của `ffmpeg -progress pipe:1`.
+
+    ffmpeg ghi từng block các dòng key=value, mỗi block kết thúc bằng
+    progress=continue (hoặc progress=end ở block cuối).
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.last = {}
+        self._block = {}
+
+    def feed(self, line):
+        key, sep, value = line.strip().partition("=")
+        if not sep:
+            return
+        self._block[key] = value.strip()
+        if key == "progress":
+            self.last, self._block = self._block, {}
+            if self.callback:
+                self.callback(self.summary())
+
+    def read(self, stream):
+        for line in stream:
+            self.feed(line if isinstance(line, str) else line.decode("utf-8", "replace"))
+
+    def summary(self):
+        last = self.last
+        out_us = last.get("out_time_us") or last.get("out_time_ms")  # cả hai đều là micro giây
+        result = {
+            "frames": int(last["frame"]) if last.get("frame", "").isdigit() else None,
+            "fps": parse_speed(last.get("fps", "")),
+            "out_seconds": int(out_us) / 1e6 if out_us and out_us.lstrip("-").isdigit() else None,
+            "total_size": int(last["total_size"]) if last.get("total_size", "").isdigit() else None,
+            "speed": parse_speed(last.get("speed", "")),
+        }
+        return {k: v for k, v in result.items() if v is not None}
+
+
+class MetricsSink:
+    """Ghi metrics theo từng stage (probe / normalize / concat / job) ra file JSON-lines theo ngày.
+
+    Có thể đăng ký callback trong process (add_listener) để theo dõi hoặc cảnh báo.
+    """
+
+    def __init__(self, directory=METRICS_DIR):
+        self.directory = directory
+        self.listeners = []
+        self._lock = threading.Lock()
+
+    def path(self):
+        return os.path.join(self.directory, f"{datetime.now().strftime('%Y-%m-%d')}.jsonl")
+
+    def add_listener(self, callback):
+        self.listeners.append(callback)
+
+    def remove_listener(self, callback):
+        if callback in self.listeners:
+            self.listeners.remove(callback)
+
+    def record(self, stage, **fields):
+        record = {"ts": datetime.now().isoformat(timespec="seconds"), "stage": stage, **fields}
+        line = json.dumps(record, ensure_ascii=False, default=str) + "\n"
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self.path(), "a", encoding="utf-8") as f:
+                f.write(line)
+        for callback in list(self.listeners):
+            try:
+                callback(record)
+            except Exception as e:
+                print(f"[ERR] metrics listener: {e}")
+        return record
+
+    @contextmanager
+    def timer(self, stage, **fields):
+        """with metrics.timer("probe", clip=path) as rec: ... (thêm field vào rec nếu cần)"""
+        rec = dict(fields)
+        start = time.perf_counter()
+        ok = False
+        try:
+            yield rec
+            ok = True
+        finally:
+            rec.setdefault("seconds", round(time.perf_counter() - start, 3))
+            self.record(stage, ok=ok, **rec)
+
+
+_metrics = MetricsSink()
+
+
+def get_metrics():
+    return _metrics
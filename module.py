@@ -1,4 +1,8 @@
 import os
+import sys
+import time
+import threading
+import itertools
 import subprocess
 import json
 from concurrent.futures import ThreadPoolExecutor
@@ -6,23 +10,184 @@ import gspread
 from google.oauth2.service_account import Credentials
 from pathlib import Path
 import shutil
+import tempfile
+from contextlib import contextmanager
+from collections import deque
 import pandas as pd
 import numpy as np
 import random
 from datetime import datetime
+from clip_cache import NormalizedClipCache
+from clip_sampler import ClipSampler
+from encode_scheduler import EncodeScheduler
+from journal import channel_journal, pending_sheet_rows, job_checkpoint
+from used_store import UsedVideoStore
+from probe import get_probe_service
+from metrics import ProgressParser, get_metrics
+from prefetch import SourcePrefetcher
+from proc_runner import get_process_runner
+from command_log import get_command_log
 
 # === Cấu hình log ===
-LOG_DIR = "log_data\logs"
-os.makedirs(LOG_DIR, exist_ok=True)
-LOG_FILE = os.path.join(LOG_DIR, f"{datetime.now().strftime('%Y-%m-%d')}.log")
+# mỗi lệnh một dòng JSON trong log_data/logs/<ngày>.jsonl (xem command_log.py, log_query.py)
 
-def log_run(cmd, **kwargs):
-    """Chạy subprocess và ghi toàn bộ stdout/stderr vào file log theo ngày."""
-    with open(LOG_FILE, "a", encoding="utf-8") as log:
-        log.write(f"\n=== [{datetime.now().strftime('%H:%M:%S')}] {' '.join(cmd)} ===\n")
-        result = subprocess.run(cmd, stdout=log, stderr=log, text=True, **kwargs)
-        log.write("\n")
-    return result
+# ffmpeg không ghi tiến độ trong chừng này giây thì coi là treo (đọc share mạng bị đứng, ...)
+FFMPEG_IDLE_TIMEOUT = int(os.environ.get("CONCAT_FFMPEG_IDLE_TIMEOUT", 300))   # 0 = tắt
+
+
+def _with_progress(cmd):
+    """Thêm `-progress pipe:1 -nostats` vào lệnh ffmpeg: tiến độ đọc qua stdout, stderr không còn
+    dòng stats (và banner build) nên phần đuôi stderr giữ lại khi lỗi chỉ còn thông báo lỗi."""
+    if os.path.splitext(os.path.basename(cmd[0]))[0] != "ffmpeg":
+        return cmd, False
+    return [cmd[0], "-hide_banner", "-progress", "pipe:1", "-nostats", *cmd[1:]], True
+
+
+def command_encoder(cmd):
+    for flag in ("-c:v", "-vcodec", "-c"):
+        if flag in cmd:
+            return cmd[cmd.index(flag) + 1]
+    return None
+
+
+def _file_size(path):
+    try:
+        return os.path.getsize(path)
+    except (OSError, TypeError):
+        return 0
+
+
+def command_metrics(cmd, seconds, progress):
+    """Record metrics của một lệnh ffmpeg: encoder, thời gian, bytes vào/ra, tốc độ so với realtime."""
+    inputs = [cmd[i + 1] for i, arg in enumerate(cmd[:-1]) if arg == "-i"]
+    fields = {
+        "encoder": command_encoder(cmd),
+        "seconds": round(seconds, 3),
+        "bytes_in": sum(_file_size(p) for p in inputs),
+        "bytes_out": _file_size(cmd[-1]),
+        **{k: v for k, v in progress.items() if k != "total_size"},
+    }
+    if progress.get("out_seconds") and seconds > 0:
+        fields["realtime"] = round(progress["out_seconds"] / seconds, 2)
+    return fields
+
+
+class CancelScope:
+    """Huỷ các ffmpeg đang chạy của một output khi output đó chắc chắn hỏng.
+
+    Process (hoặc CancelScope con) đăng ký vào scope; cancel() kill tất cả, process
+    đăng ký sau khi đã huỷ bị kill ngay.
+    """
+
+    def __init__(self):
+        self.cancelled = False
+        self._members = set()
+        self._lock = threading.Lock()
+
+    def register(self, member):
+        with self._lock:
+            if not self.cancelled:
+                self._members.add(member)
+                return
+        member.kill()
+
+    def unregister(self, member):
+        with self._lock:
+            self._members.discard(member)
+
+    def cancel(self):
+        with self._lock:
+            self.cancelled = True
+            members, self._members = list(self._members), set()
+        for member in members:
+            try:
+                member.kill()
+            except OSError:
+                pass
+
+    kill = cancel
+
+    def check(self):
+        if self.cancelled:
+            raise RuntimeError("Job đã bị huỷ")
+
+
+def log_run(cmd, stage=None, tags=None, on_progress=None, cancel=None, timeout=None, idle_timeout=None, **kwargs):
+    """Chạy subprocess, ghi một record vào command log (argv, exit code, thời gian, stderr khi lỗi).
+
+    Process chạy trên event loop chung (ProcessRunner).
+    Với ffmpeg, tiến độ được đọc qua `-progress`; on_progress(dict) được gọi sau mỗi block.
+    Nếu có `stage`, ghi một record metrics (kèm các field trong `tags`) khi lệnh kết thúc.
+    cancel: CancelScope, process bị kill khi scope bị huỷ.
+    timeout / idle_timeout: giây; ffmpeg mặc định bị kill khi không có tiến độ trong
+    FFMPEG_IDLE_TIMEOUT giây. Hết giờ thì raise subprocess.TimeoutExpired.
+    """
+    check = kwargs.pop("check", False)
+    if cancel is not None:
+        cancel.check()
+    run_cmd, progress = _with_progress(cmd)
+    if idle_timeout is None and progress:
+        idle_timeout = FFMPEG_IDLE_TIMEOUT or None
+    parser = ProgressParser(on_progress)
+    error = None
+    start = time.perf_counter()
+    try:
+        result = get_process_runner().run(
+            run_cmd, cancel=cancel, timeout=timeout, idle_timeout=idle_timeout,
+            on_stdout=parser.feed if progress else None, **kwargs
+        )
+        returncode, stderr = result.returncode, result.stderr
+    except subprocess.TimeoutExpired as e:
+        error = e
+        returncode, stderr = None, e.stderr
+    seconds = time.perf_counter() - start
+
+    get_command_log().command(cmd, returncode, seconds, stage, tags, stderr, timeout=error is not None)
+    if stage and progress:
+        get_metrics().record(stage, ok=returncode == 0, **({"timeout": True} if error else {}),
+                             **{**command_metrics(cmd, seconds, parser.summary()), **(tags or {})})
+    if error is not None:
+        raise error
+    if check and returncode != 0:
+        raise subprocess.CalledProcessError(returncode, cmd, stderr=stderr)
+    return subprocess.CompletedProcess(cmd, returncode, stderr=stderr)
+
+
+@contextmanager
+def log_popen(cmd, stage=None, tags=None, on_progress=None, **kwargs):
+    """Như log_run nhưng trả về Popen đang chạy (để ghi dữ liệu vào stdin).
+
+    `tags` được đọc khi process kết thúc, nên caller có thể cập nhật nó trong lúc chạy.
+    """
+    run_cmd, progress = _with_progress(cmd)
+    parser = ProgressParser(on_progress)
+    tail = deque(maxlen=20)
+    start = time.perf_counter()
+    proc = subprocess.Popen(run_cmd, stdout=subprocess.PIPE if progress else subprocess.DEVNULL,
+                            stderr=subprocess.PIPE, **kwargs)
+    readers = [threading.Thread(target=lambda: tail.extend(line.decode("utf-8", "replace") for line in proc.stderr),
+                                daemon=True)]
+    if progress:
+        readers.append(threading.Thread(target=parser.read, args=(proc.stdout,), daemon=True))
+    for reader in readers:
+        reader.start()
+    try:
+        yield proc
+    finally:
+        if proc.poll() is None:
+            proc.kill()
+        returncode = proc.wait()
+        for reader in readers:
+            reader.join()
+        for stream in (proc.stdout, proc.stderr):
+            if stream:
+                stream.close()
+        seconds = time.perf_counter() - start
+        get_command_log().command(cmd, returncode, seconds, stage, tags, "".join(tail))
+        if stage:
+            get_metrics().record(stage, ok=returncode == 0, **{
+                **command_metrics(cmd, seconds, parser.summary()), **(tags or {})
+            })
 
 
 def load_used_videos(file):
@@ -42,20 +207,21 @@ def get_file_name(file_path):
     name_without_ext = os.path.splitext(base_name)[0]    
     return name_without_ext
 
+def get_video_seconds(file_path):
+    """Thời lượng chính xác (giây) qua probe service dùng chung."""
+    return get_probe_service().duration(file_path)
+
+
 def get_video_duration(file_path):
     try:
-        cmd = [
-            "ffprobe", "-v", "error", "-show_entries", "format=duration",
-            "-of", "default=noprint_wrappers=1:nokey=1", file_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        duration = float(result.stdout.strip())
+        duration = get_video_seconds(file_path)
+        if duration <= 0:
+            raise ValueError("không đọc được thời lượng")
         minute = int(duration) // 60
         sec = int(duration) % 60
         return f"{minute}:{sec:02}"
     except Exception as e:
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"[ERROR] get_video_duration({file_path}): {e}\n")
+        get_command_log().write("error", where="get_video_duration", path=file_path, error=str(e))
         return "0:00"
 
 
@@ -63,6 +229,67 @@ def find_first_vid(first_vd):
     first_vd = first_vd.strip().strip('"')
     return first_vd, get_video_duration(first_vd)
 
+def copy_mux_args(container, fps=60):
+    """Tham số mux khi stream copy H.264 sang container đích."""
+    if container == "mpegts":
+        return ["-bsf:v", "h264_mp4toannexb", *container_args(container)]
+    # cùng timescale với output của normalize_video để concat không bị lệch dts
+    return ["-video_track_timescale", str(fps * 256), *container_args(container)]
+
+
+def container_args(container):
+    # mpegts: segment ghép nối tiếp được bằng cách nối byte, không cần ghi lại file để faststart
+    if container == "mpegts":
+        return ["-f", "mpegts"]
+    return ["-movflags", "+faststart"]
+
+
+# CONCAT_USE_NVENC=0: luôn encode bằng libx264 (máy không có GPU, benchmark)
+USE_NVENC = os.environ.get("CONCAT_USE_NVENC", "1") != "0"
+
+
+def pick_video_codec(use_nvenc=True):
+    return "h264_nvenc" if use_nvenc and USE_NVENC and shutil.which("nvidia-smi") else "libx264"
+
+
+def normalize_params(width=1920, height=1080, fps=60, use_nvenc=True, cq=23, v_bitrate="12M", a_bitrate="160k"):
+    """Tham số normalize thực tế (dùng làm một phần key cache)."""
+    return {
+        "width": width,
+        "height": height,
+        "fps": fps,
+        "codec": pick_video_codec(use_nvenc),
+        "cq": cq,
+        "v_bitrate": v_bitrate,
+        "a_bitrate": a_bitrate,
+    }
+
+
+def video_encode_args(vcodec, cq=23, v_bitrate="12M"):
+    """Tham số encoder H.264 Main dùng chung cho normalize và filtergraph concat."""
+    if vcodec == "h264_nvenc":
+        return [
+            "-c:v", vcodec,
+            "-profile:v", "main",
+            "-rc", "vbr",
+            "-cq", str(cq),
+            "-b:v", v_bitrate,
+            "-maxrate", v_bitrate,
+            "-bufsize", str(int(int(v_bitrate[:-1]) * 2)) + "M" if v_bitrate.endswith("M") else "16M",
+            "-preset", "medium",
+            "-vsync", "1",
+        ]
+    return [
+        "-c:v", vcodec,
+        "-preset", "medium",
+        "-profile:v", "main",
+        "-level", "4.2",
+        "-crf", str(cq if isinstance(cq, int) else 20),
+        "-maxrate", v_bitrate,
+        "-bufsize", "16M",
+    ]
+
+
 def normalize_video(
     input_path,
     output_path,
@@ -73,114 +300,920 @@ def normalize_video(
     cq=23,
     v_bitrate="12M",
     a_bitrate="160k",
+    threads=None,
+    container="mp4",
+    tags=None,
+    start=None,
+    length=None,
+    audio=True,
+    cancel=None,
 ):
+    """start/length: chỉ encode một đoạn (giây) của input; audio=False: chỉ xuất video (GOP đóng)."""
     if not isinstance(input_path, str) or not isinstance(output_path, str):
         raise TypeError(f"Đường dẫn input/output không hợp lệ: input={input_path}, output={output_path}")
 
     if not shutil.which("ffmpeg"):
         raise RuntimeError("ffmpeg không được tìm thấy trong PATH.")
 
-    if use_nvenc and shutil.which("nvidia-smi"):
-        vcodec = "h264_nvenc"
-        video_args = [
-            "-c:v", vcodec,
-            "-profile:v", "main",
-            "-rc", "vbr",
-            "-cq", str(cq),
-            "-b:v", v_bitrate,
-            "-maxrate", v_bitrate,
-            "-bufsize", str(int(int(v_bitrate[:-1]) * 2)) + "M" if v_bitrate.endswith("M") else "16M",
-            "-preset", "medium",
-            "-vsync", "1",
-        ]
-    else:
-        vcodec = "libx264"
-        video_args = [
-            "-c:v", vcodec,
-            "-preset", "medium",
-            "-profile:v", "main",
-            "-level", "4.2",
-            "-crf", str(cq if isinstance(cq, int) else 20),
-            "-maxrate", v_bitrate,
-            "-bufsize", "16M",
-        ]
-
+    video_args = video_encode_args(pick_video_codec(use_nvenc), cq, v_bitrate)
+    thread_args = ["-threads", str(threads)] if threads else []
+    seek_args = ["-ss", str(start)] if start else []
+    length_args = ["-t", str(length)] if length else []
+    audio_args = ["-c:a", "aac", "-ar", "48000", "-b:a", a_bitrate] if audio else ["-an", "-flags", "+cgop"]
     command = [
         "ffmpeg", "-y",
         "-fflags", "+genpts",
+        *thread_args,
+        *seek_args,
         "-i", input_path,
         "-vf", f"scale={width}:{height},fps={fps}",
         *video_args,
+        *thread_args,
         "-pix_fmt", "yuv420p",
         "-r", str(fps),
-        "-movflags", "+faststart",
-        "-c:a", "aac",
-        "-ar", "48000",
-        "-b:a", a_bitrate,
+        *length_args,
+        *container_args(container),
+        *audio_args,
         output_path
     ]
 
-    log_run(command, check=True)
+    log_run(command, check=True, stage="normalize", tags=tags, cancel=cancel)
+
+
+# === Thư mục tạm riêng cho từng job ===
+# Nên đặt trên SSD/tmpfs local, khác ổ output. Mặc định dùng thư mục temp của hệ thống.
+SCRATCH_DIR = os.environ.get("CONCAT_SCRATCH_DIR") or tempfile.gettempdir()
+
+
+def check_free_space(path, required_bytes):
+    free = shutil.disk_usage(path).free
+    if free < required_bytes:
+        raise RuntimeError(
+            f"Không đủ dung lượng trống ở {path}: cần {required_bytes / 1024**3:.1f} GB, "
+            f"còn {free / 1024**3:.1f} GB"
+        )
 
 
-def concat_video(video_paths, output_path):
-    list_file = "temp.txt"
+@contextmanager
+def job_workspace(required_bytes=0, root=None, prefix="concat_"):
+    """Tạo thư mục tạm không trùng cho một job, luôn xoá khi kết thúc (kể cả khi lỗi)."""
+    root = root or SCRATCH_DIR
+    os.makedirs(root, exist_ok=True)
+    check_free_space(root, required_bytes)
+    workdir = tempfile.mkdtemp(prefix=prefix, dir=root)
+    try:
+        yield workdir
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+def write_concat_list(video_paths, list_file):
+    """File danh sách cho concat demuxer (escape dấu ' trong đường dẫn)."""
     with open(list_file, 'w', encoding='utf-8') as f:
         for path in video_paths:
-            abs_path = os.path.abspath(path).replace("\\", "/")
+            abs_path = os.path.abspath(path).replace("\\", "/").replace("'", "'\\''")
             f.write(f"file '{abs_path}'\n")
+    return list_file
+
+
+def concat_video(video_paths, output_path, channel=None, workdir=None):
+    if workdir is None:
+        with job_workspace() as workdir:
+            return concat_video(video_paths, output_path, channel, workdir)
+
+    list_file = write_concat_list(video_paths, os.path.join(workdir, "concat_list.txt"))
+
+    command = [
+        "ffmpeg", "-y",
+        "-f", "concat", "-safe", "0",
+        "-i", list_file,
+        "-c", "copy",
+        output_path
+    ]
+    tags = {"channel": channel, "clips": len(video_paths), "bytes_in": sum(_file_size(p) for p in video_paths)}
+    with get_encode_scheduler().slot(channel, "copy"):
+        log_run(command, check=True, stage="concat", tags=tags)
+
+
+# === Kiểm tra clip đã đúng định dạng đích chưa ===
+CLIP_COPY = "copy"            # dùng nguyên file
+CLIP_AUDIO = "audio"          # copy video, encode lại audio
+CLIP_REMUX = "remux"          # chỉ đổi container
+CLIP_TRANSCODE = "transcode"  # encode lại toàn bộ
+
+CONCAT_CONTAINERS = {".mp4", ".mov", ".m4v"}
+
+
+def probe_video_info(video_path):
+    """JSON ffprobe của clip; {} nếu probe lỗi (xem ProbeService.probe)."""
+    return get_probe_service().probe(video_path) or {}
+
+
+def parse_frame_rate(rate):
+    try:
+        num, _, den = str(rate).partition("/")
+        return float(num) / float(den or 1)
+    except (ValueError, ZeroDivisionError):
+        return 0.0
+
+
+def classify_clip(info, input_path, width=1920, height=1080, fps=60):
+    """Phân loại clip theo cách xử lý rẻ nhất để ghép được với các clip đã normalize."""
+    streams = info.get("streams", [])
+    videos = [s for s in streams if s.get("codec_type") == "video" and not s.get("disposition", {}).get("attached_pic")]
+    audios = [s for s in streams if s.get("codec_type") == "audio"]
+    if len(videos) != 1 or len(audios) != 1:
+        return CLIP_TRANSCODE
+
+    v, a = videos[0], audios[0]
+    video_ok = (
+        v.get("codec_name") == "h264"
+        and v.get("profile") == "Main"
+        and v.get("pix_fmt") == "yuv420p"
+        and v.get("width") == width
+        and v.get("height") == height
+        and v.get("field_order", "progressive") == "progressive"
+        and abs(parse_frame_rate(v.get("r_frame_rate")) - fps) < 0.01
+        and abs(parse_frame_rate(v.get("avg_frame_rate")) - fps) < 0.5
+    )
+    if not video_ok:
+        return CLIP_TRANSCODE
+
+    audio_ok = a.get("codec_name") == "aac" and str(a.get("sample_rate")) == "48000"
+    if not audio_ok:
+        return CLIP_AUDIO
+    if os.path.splitext(input_path)[1].lower() not in CONCAT_CONTAINERS:
+        return CLIP_REMUX
+    # concat demuxer -c copy ghép theo index stream, không có -map: chỉ dùng nguyên file khi
+    # đúng 2 stream, video ở 0 và audio ở 1 (audio trước, thêm data/cover stream thì remux)
+    if len(streams) != 2 or streams.index(v) != 0 or streams.index(a) != 1:
+        return CLIP_REMUX
+    return CLIP_COPY
+
+
+# === Ước lượng chi phí xử lý clip (xếp lịch longest-first, tính ETA) ===
+# đơn vị: số giây clip 1920x1080@60 cần transcode
+AUDIO_COST_FACTOR = 0.1     # encode riêng audio AAC
+REMUX_COST_FACTOR = 0.02    # stream copy, chủ yếu là I/O
+
+
+def resolution_factor(info, width=1920, height=1080, fps=60):
+    """Chi phí decode nguồn + encode đích so với clip đã đúng chuẩn (1.0)."""
+    video = next((s for s in info.get("streams", []) if s.get("codec_type") == "video"), {})
+    target = width * height * fps
+    source = (
+        (video.get("width") or width) * (video.get("height") or height)
+        * (parse_frame_rate(video.get("avg_frame_rate")) or fps)
+    )
+    return (source + target) / (2 * target)
+
+
+def estimate_cost(info, mode, width=1920, height=1080, fps=60):
+    try:
+        duration = float(info.get("format", {}).get("duration", 0) or 0)
+    except (TypeError, ValueError):
+        duration = 0.0
+    if mode == CLIP_TRANSCODE:
+        return duration * resolution_factor(info, width, height, fps)
+    if mode == CLIP_AUDIO:
+        return duration * AUDIO_COST_FACTOR
+    if mode == CLIP_REMUX:
+        return duration * REMUX_COST_FACTOR
+    return 0.0
+
+
+class ConcatEstimate:
+    """Ước lượng thời điểm xong một output từ phần chi phí đã làm được.
+
+    callback(snapshot) được gọi mỗi khi xong một phần việc.
+    """
+
+    def __init__(self, total_cost, callback=None):
+        self.total = total_cost
+        self.done = 0.0
+        self.callback = callback
+        self.start = time.monotonic()
+        self._lock = threading.Lock()
+
+    def advance(self, cost):
+        with self._lock:
+            self.done += cost
+            snapshot = self.snapshot()
+        if self.callback:
+            self.callback(snapshot)
+        return snapshot
+
+    def add_cost(self, delta):
+        with self._lock:
+            self.total += delta
+
+    def eta_seconds(self):
+        """Số giây còn lại theo tốc độ thực tế tới giờ; None khi chưa xong phần nào."""
+        if self.done <= 0:
+            return None
+        elapsed = time.monotonic() - self.start
+        return max(0.0, elapsed * (self.total - self.done) / self.done)
+
+    def snapshot(self):
+        eta = self.eta_seconds()
+        return {
+            "done_cost": round(self.done, 1),
+            "total_cost": round(self.total, 1),
+            "elapsed": round(time.monotonic() - self.start, 1),
+            "eta_seconds": None if eta is None else round(eta, 1),
+            "eta": None if eta is None else datetime.fromtimestamp(time.time() + eta).strftime('%H:%M:%S'),
+        }
+
+
+def remux_video(input_path, output_path, reencode_audio=False, fps=60, a_bitrate="160k", threads=None,
+                container="mp4", tags=None, cancel=None):
+    audio_args = ["-c:a", "aac", "-ar", "48000", "-b:a", a_bitrate] if reencode_audio else ["-c:a", "copy"]
+    command = [
+        "ffmpeg", "-y",
+        "-fflags", "+genpts",
+        *(["-threads", str(threads)] if threads else []),
+        "-i", input_path,
+        "-map", "0:v:0", "-map", "0:a:0",
+        "-c:v", "copy",
+        *audio_args,
+        *copy_mux_args(container, fps),
+        output_path
+    ]
+    log_run(command, check=True, stage="normalize", tags=tags, cancel=cancel)
+
+
+# === Encode song song theo đoạn cho clip dài ===
+# Clip transcode dài hơn CHUNK_MIN_SECONDS được cắt thành các đoạn CHUNK_SECONDS giây,
+# các đoạn video encode song song, audio encode một lần, rồi ghép lại bằng stream copy.
+CHUNK_MIN_SECONDS = int(os.environ.get("CONCAT_CHUNK_MIN_SECONDS", 240))   # 0 = tắt
+CHUNK_SECONDS = 60
+
+
+def chunk_ranges(duration, chunk_seconds=CHUNK_SECONDS):
+    """[(start, length), ...] phủ hết clip; length=None là đoạn cuối (encode tới hết file).
+
+    Phần dư ngắn hơn nửa đoạn được gộp vào đoạn cuối thay vì thành một đoạn riêng.
+    """
+    ranges = []
+    start = 0
+    while duration - start >= chunk_seconds * 1.5:
+        ranges.append((start, chunk_seconds))
+        start += chunk_seconds
+    ranges.append((start, None))
+    return ranges
+
+
+def encode_audio(input_path, output_path, a_bitrate="160k", threads=None, tags=None, cancel=None):
+    command = [
+        "ffmpeg", "-y",
+        *(["-threads", str(threads)] if threads else []),
+        "-i", input_path,
+        "-vn",
+        "-c:a", "aac",
+        "-ar", "48000",
+        "-b:a", a_bitrate,
+        output_path
+    ]
+    log_run(command, check=True, stage="normalize", tags=tags, cancel=cancel)
+
 
+def stitch_chunks(chunk_paths, audio_path, output_path, workdir, fps=60, container="mp4", tags=None, cancel=None):
+    """Ghép các đoạn video (đều bắt đầu bằng IDR, GOP đóng) + track audio mà không encode lại."""
+    list_file = write_concat_list(chunk_paths, os.path.join(workdir, "chunks.txt"))
     command = [
         "ffmpeg", "-y",
         "-f", "concat", "-safe", "0",
         "-i", list_file,
+        *(["-i", audio_path] if audio_path else []),
+        "-map", "0:v:0",
+        *(["-map", "1:a:0"] if audio_path else []),
         "-c", "copy",
+        *copy_mux_args(container, fps),
         output_path
     ]
-    log_run(command, check=True)
-    os.remove(list_file)
+    log_run(command, check=True, stage="stitch", tags=tags, cancel=cancel)
+
+
+def normalize_chunked(input_path, output_path, channel=None, container="mp4", duration=None,
+                      chunk_seconds=CHUNK_SECONDS, fps=60, factor=1.0, cancel=None, source=None, profile=None,
+                      scratch_dir=None, queue_cost=None):
+    """Như normalize_video nhưng encode song song theo đoạn (dùng cho clip dài).
+
+    factor: chi phí mỗi giây clip (resolution_factor), để xếp lịch cùng các clip khác.
+    Một đoạn lỗi thì các đoạn còn lại của clip bị huỷ luôn.
+    source: file ffmpeg thực sự đọc (mặc định là input_path).
+    profile: tham số encoder của kênh (use_nvenc, cq, v_bitrate, a_bitrate).
+    scratch_dir: thư mục gốc cho các đoạn tạm (mặc định SCRATCH_DIR), cần trống cỡ file nguồn.
+    queue_cost: thứ tự trong hàng chờ scheduler cho mọi đoạn (xem prepare_clip); mặc định theo
+    chi phí từng đoạn.
+    """
+    source = source or input_path
+    profile = profile or {}
+    duration = duration or get_video_seconds(input_path)
+    ranges = chunk_ranges(duration, chunk_seconds)
+    has_audio = any(s.get("codec_type") == "audio" for s in probe_video_info(input_path).get("streams", []))
+    encoder = pick_video_codec(profile.get("use_nvenc", True))
+    scheduler = get_encode_scheduler()
+    scope = CancelScope()
+    if cancel is not None:
+        cancel.register(scope)
+
+    # các đoạn + audio có bitrate cỡ file nguồn
+    with job_workspace(_file_size(source), root=scratch_dir, prefix="chunks_") as workdir:
+        def encode_chunk(i, start, length):
+            path = os.path.join(workdir, f"chunk_{i:04d}.mp4")
+            cost = (length or duration - start) * factor if queue_cost is None else queue_cost
+            with scheduler.slot(channel, encoder, cost=cost) as threads:
+                tags = {"channel": channel, "clip": input_path, "mode": CLIP_TRANSCODE, "chunk": i, "threads": threads}
+                normalize_video(source, path, fps=fps, threads=threads, start=start, length=length,
+                                audio=False, tags=tags, cancel=scope, **profile)
+            return path
+
+        def encode_audio_track():
+            path = os.path.join(workdir, "audio.m4a")
+            cost = duration * AUDIO_COST_FACTOR if queue_cost is None else queue_cost
+            with scheduler.slot(channel, "aac", cost=cost) as threads:
+                encode_audio(source, path, profile.get("a_bitrate", "160k"), threads=threads,
+                             tags={"channel": channel, "clip": input_path, "mode": "audio_track"}, cancel=scope)
+            return path
+
+        try:
+            with ThreadPoolExecutor(max_workers=len(ranges) + 1) as executor:
+                audio_future = executor.submit(encode_audio_track) if has_audio else None
+                chunk_futures = [executor.submit(encode_chunk, i, start, length) for i, (start, length) in enumerate(ranges)]
+                try:
+                    chunk_paths = [f.result() for f in chunk_futures]
+                    audio_path = audio_future.result() if audio_future else None
+                except BaseException:
+                    scope.cancel()
+                    raise
+
+            with scheduler.slot(channel, "copy"):
+                stitch_chunks(chunk_paths, audio_path, output_path, workdir, fps, container,
+                              tags={"channel": channel, "clip": input_path, "chunks": len(chunk_paths)}, cancel=scope)
+        finally:
+            if cancel is not None:
+                cancel.unregister(scope)
+
+
+def prepare_clip(input_path, output_path, mode, channel=None, container="mp4", cost=None, cancel=None,
+                 source=None, profile=None, scratch_dir=None, queue_cost=None):
+    """source: file ffmpeg thực sự đọc (bản copy local của input_path), probe vẫn theo input_path.
+
+    profile: tham số encoder của kênh, truyền thẳng cho normalize_video.
+    scratch_dir: thư mục tạm của job (cho các đoạn khi encode theo đoạn).
+    queue_cost: key xếp hàng trong scheduler (lớn vào trước); mặc định là cost (longest-first).
+    """
+    source = source or input_path
+    profile = profile or {}
+    if cost is None:
+        cost = estimate_cost(probe_video_info(input_path), mode)
+    if mode == CLIP_TRANSCODE:
+        duration = get_video_seconds(input_path)
+        if CHUNK_MIN_SECONDS and duration >= CHUNK_MIN_SECONDS:
+            return normalize_chunked(input_path, output_path, channel, container, duration,
+                                     factor=cost / duration, cancel=cancel, source=source, profile=profile,
+                                     scratch_dir=scratch_dir, queue_cost=queue_cost)
+    encoder = pick_video_codec(profile.get("use_nvenc", True)) if mode == CLIP_TRANSCODE else "copy"
+    queued = time.perf_counter()
+    # clip tốn nhất vào trước (cost), để clip dài không thành đuôi của cả output
+    with get_encode_scheduler().slot(channel, encoder, cost=cost if queue_cost is None else queue_cost) as threads:
+        # thời gian chờ slot: cho biết nghẽn ở scheduler hay ở chính ffmpeg
+        tags = {"channel": channel, "clip": input_path, "mode": mode, "threads": threads,
+                "queue_seconds": round(time.perf_counter() - queued, 3)}
+        if mode == CLIP_TRANSCODE:
+            normalize_video(source, output_path, threads=threads, container=container, tags=tags,
+                            cancel=cancel, **profile)
+        else:
+            remux_video(source, output_path, reencode_audio=(mode == CLIP_AUDIO),
+                        a_bitrate=profile.get("a_bitrate", "160k"), threads=threads,
+                        container=container, tags=tags, cancel=cancel)
+
+
+def stream_concat(segment_futures, output_path, workdir=None, channel=None):
+    """Ghép các segment MPEG-TS theo thứ tự playlist, segment nào xong thì đẩy vào ngay.
+
+    segment_futures trả về đường dẫn file .ts. ffmpeg đọc luồng TS nối tiếp từ stdin
+    (tự xử lý timestamp bị reset giữa các segment) và mux thẳng ra output, nên việc
+    mux bắt đầu trong khi các clip sau vẫn đang encode.
+    """
+    command = [
+        "ffmpeg", "-y",
+        "-f", "mpegts", "-i", "pipe:0",
+        "-map", "0:v", "-map", "0:a",
+        "-c", "copy",
+        "-bsf:a", "aac_adtstoasc",
+        output_path
+    ]
+    # không giữ slot của encode scheduler: process này chủ yếu ngồi chờ segment
+    tags = {"channel": channel, "clips": 0, "bytes_in": 0}
+    with log_popen(command, stage="concat", tags=tags, stdin=subprocess.PIPE) as proc:
+        try:
+            for future in segment_futures:
+                segment = future.result()
+                tags["clips"] += 1
+                tags["bytes_in"] += _file_size(segment)
+                with open(segment, "rb") as f:
+                    shutil.copyfileobj(f, proc.stdin, 4 * 1024 * 1024)
+                if workdir and os.path.dirname(os.path.abspath(segment)) == os.path.abspath(workdir):
+                    os.remove(segment)
+            proc.stdin.close()
+        except BrokenPipeError:
+            pass
+        returncode = proc.wait()
+    if returncode != 0:
+        raise subprocess.CalledProcessError(returncode, command)
+
+
+# === Ghép một lượt bằng filter concat ===
+# Một ffmpeg đọc mọi clip, đưa từng input qua scale/fps/aresample vào filter concat và
+# encode thẳng ra output: không có N file tạm, không có bước mux riêng.
+ENGINE_SEGMENTS = "segments"          # normalize từng clip rồi concat demuxer (mặc định cũ)
+ENGINE_FILTERGRAPH = "filtergraph"    # một process, filter concat
+CONCAT_ENGINE = os.environ.get("CONCAT_ENGINE", "auto")    # auto | segments | filtergraph
+FILTERGRAPH_MAX_INPUTS = 32     # mỗi input là một decoder mở suốt cả lệnh
+FILTERGRAPH_MAX_THREADS = 16    # x264 một process không tăng tốc thêm nhiều quá mức này
+SEGMENT_OVERHEAD_COST = 1.0     # chi phí cố định mỗi segment: khởi động ffmpeg, ghi file tạm
+
+
+def main_streams(info):
+    """(index video, index audio) trong số stream cùng loại của clip; audio None nếu không có."""
+    videos = [s for s in info.get("streams", []) if s.get("codec_type") == "video"]
+    audios = [s for s in info.get("streams", []) if s.get("codec_type") == "audio"]
+    v = next((k for k, s in enumerate(videos) if not s.get("disposition", {}).get("attached_pic")), 0)
+    return v, (0 if audios else None)
+
+
+def filtergraph_cost(infos, width=1920, height=1080, fps=60):
+    """Chi phí encode lại toàn bộ các clip (filter concat không copy được clip nào)."""
+    return sum(estimate_cost(info, CLIP_TRANSCODE, width, height, fps) for info in infos)
+
+
+def pick_concat_engine(plans, infos, streaming=False, preferred=None, cores=None, use_nvenc=True, cached=None):
+    """Chọn engine theo số clip và số core.
+
+    Segment path encode song song nhiều clip và bỏ qua clip đã đúng chuẩn hoặc đã có trong
+    cache normalize, nhưng mỗi clip phải encode tốn thêm một process và một file tạm.
+    Filtergraph chỉ có một encoder (dùng tối đa FILTERGRAPH_MAX_THREADS thread) và phải
+    encode lại mọi clip. So sánh thời gian ước tính của hai cách (đơn vị cost, xem estimate_cost).
+    cached[i]: clip i đã có trong cache normalize (segment path không tốn gì cho clip đó).
+    preferred (mặc định CONCAT_ENGINE) ép engine, trừ khi filtergraph không dùng được.
+    """
+    preferred = preferred or CONCAT_ENGINE
+    if streaming or len(plans) < 2 or any(main_streams(info)[1] is None for info in infos):
+        return ENGINE_SEGMENTS
+    if preferred in (ENGINE_SEGMENTS, ENGINE_FILTERGRAPH):
+        return preferred
+    if len(plans) > FILTERGRAPH_MAX_INPUTS:
+        return ENGINE_SEGMENTS
+    scheduler = get_encode_scheduler()
+    cores = cores or scheduler.total
+    encoder = pick_video_codec(use_nvenc)
+    per_job = scheduler.threads_for(encoder)
+    jobs = max(1, cores // per_job)
+    cached = cached or [False] * len(plans)
+    costs = [0.0 if hit else cost for (_, cost), hit in zip(plans, cached)]
+    encoded = sum(1 for (mode, _), hit in zip(plans, cached) if mode != CLIP_COPY and not hit)
+    segment_wall = max(sum(costs) / jobs, max(costs)) + SEGMENT_OVERHEAD_COST * encoded / jobs
+    # NVENC: tốc độ không tăng theo số thread CPU
+    speedup = max(1.0, min(cores, FILTERGRAPH_MAX_THREADS) / per_job) if encoder == "libx264" else 1.0
+    filter_wall = filtergraph_cost(infos) / speedup
+    return ENGINE_FILTERGRAPH if filter_wall < segment_wall else ENGINE_SEGMENTS
+
+
+def concat_filtergraph(input_paths, output_path, infos, channel=None, cost=0, on_progress=None, cancel=None,
+                       width=1920, height=1080, fps=60, use_nvenc=True, cq=23, v_bitrate="12M",
+                       a_bitrate="160k"):
+    """Normalize + ghép input_paths trong một lệnh ffmpeg (filter concat).
 
-def auto_concat(input_videos, output_path):
+    infos: JSON ffprobe của từng input (chọn đúng stream video/audio, bỏ ảnh bìa).
+    Chỉ stream được map mới bị decode. Mọi input phải có audio.
+    """
+    inputs, chains, labels = [], [], []
+    for i, (path, info) in enumerate(zip(input_paths, infos)):
+        v, a = main_streams(info)
+        if a is None:
+            raise ValueError(f"Clip không có audio, không ghép bằng filter concat được: {path}")
+        inputs += ["-i", path]
+        chains.append(
+            f"[{i}:v:{v}]scale={width}:{height},setsar=1,fps={fps},format=yuv420p,setpts=PTS-STARTPTS[v{i}]"
+        )
+        chains.append(
+            f"[{i}:a:{a}]aresample=48000,aformat=sample_fmts=fltp:channel_layouts=stereo,"
+            f"asetpts=PTS-STARTPTS[a{i}]"
+        )
+        labels.append(f"[v{i}][a{i}]")
+    chains.append(f"{''.join(labels)}concat=n={len(labels)}:v=1:a=1[v][a]")
+
+    scheduler = get_encode_scheduler()
+    vcodec = pick_video_codec(use_nvenc)
+    threads = min(scheduler.total, FILTERGRAPH_MAX_THREADS) if vcodec == "libx264" else None
+    queued = time.perf_counter()
+    with scheduler.slot(channel, vcodec, threads=threads, cost=cost) as threads:
+        command = [
+            "ffmpeg", "-y",
+            *inputs,
+            "-filter_complex", ";".join(chains),
+            "-map", "[v]", "-map", "[a]",
+            *video_encode_args(vcodec, cq, v_bitrate),
+            "-threads", str(threads),
+            "-r", str(fps),
+            "-c:a", "aac", "-ar", "48000", "-b:a", a_bitrate,
+            *container_args("mp4"),
+            output_path
+        ]
+        tags = {"channel": channel, "clips": len(input_paths), "engine": ENGINE_FILTERGRAPH,
+                "threads": threads, "queue_seconds": round(time.perf_counter() - queued, 3),
+                "bytes_in": sum(_file_size(p) for p in input_paths)}
+        log_run(command, check=True, stage="concat", tags=tags, on_progress=on_progress, cancel=cancel)
+
+
+_clip_cache = None
+_encode_scheduler = None
+_prefetcher = None
+# các kênh chạy song song trong loop.py: mỗi object dùng chung chỉ được tạo một lần
+# (hai cache riêng có pin / key lock riêng, sẽ evict hoặc encode trùng của nhau)
+_shared_lock = threading.Lock()
+MAX_CLIP_WORKERS = 16
+
+def get_clip_cache():
+    global _clip_cache
+    with _shared_lock:
+        if _clip_cache is None:
+            _clip_cache = NormalizedClipCache()
+        return _clip_cache
+
+
+def get_encode_scheduler():
+    global _encode_scheduler
+    with _shared_lock:
+        if _encode_scheduler is None:
+            _encode_scheduler = EncodeScheduler()
+        return _encode_scheduler
+
+
+def _record_prefetch(path, size, seconds):
+    get_metrics().record("prefetch", clip=path, bytes_in=size, seconds=round(seconds, 3),
+                         mb_per_s=round(size / 1024 ** 2 / seconds, 1) if seconds > 0 else None)
+
+
+def get_prefetcher():
+    global _prefetcher
+    with _shared_lock:
+        if _prefetcher is None:
+            _prefetcher = SourcePrefetcher(on_copied=_record_prefetch)
+        return _prefetcher
+
+
+def prefetch_sources(paths):
+    """Bắt đầu copy trước các clip ở xa (share mạng) cho output sắp chạy."""
+    get_prefetcher().prefetch(paths)
+
+
+MAX_SUBSTITUTES = 3     # số lần thay clip hỏng tối đa cho mỗi vị trí trong playlist
+# ffmpeg lỗi khi ổ đang ghi còn ít hơn mức này thì coi là lỗi của máy, không phải của clip
+MIN_FREE_BYTES = 1024 ** 3
+# stderr ffmpeg có các chuỗi này: lỗi phía encoder / máy (hết session NVENC, hết ổ, hết RAM)
+MACHINE_ERRORS = ("nvenc", "cuda", "no space left on device", "cannot allocate memory")
+
+CLIP_MISSING = "missing"    # không thấy / không probe được file (share chập chờn): thay clip, không quarantine
+CLIP_BROKEN = "broken"      # file hỏng: thay clip và quarantine
+
+
+def has_video(info):
+    return any(s.get("codec_type") == "video" for s in (info or {}).get("streams", []))
+
+
+def clip_fault(path, error):
+    """Lỗi có phải do chính clip không: CLIP_BROKEN, CLIP_MISSING, hoặc None nếu do máy
+    (timeout, hết ổ, NVENC, thiếu ffmpeg) - khi đó không thay clip, không quarantine."""
+    if isinstance(error, subprocess.TimeoutExpired):
+        return None
+    if not os.path.exists(path):
+        return CLIP_MISSING
+    if not isinstance(error, subprocess.CalledProcessError):
+        return None
+    stderr = str(error.stderr or "").lower()
+    if any(marker in stderr for marker in MACHINE_ERRORS):
+        return None
+    # ổ mà lệnh lỗi đang ghi (thư mục tạm của job hoặc cache normalize)
+    try:
+        if shutil.disk_usage(os.path.dirname(os.path.abspath(str(error.cmd[-1])))).free < MIN_FREE_BYTES:
+            return None
+    except OSError:
+        return None
+    return CLIP_BROKEN
+
+
+def error_reason(error):
+    if isinstance(error, subprocess.CalledProcessError):
+        return f"{os.path.basename(str(error.cmd[0]))} exit {error.returncode}"
+    return str(error)
+
+
+def auto_concat(input_videos, output_path, use_cache=True, channel=None, scratch_dir=None, streaming=False,
+                on_progress=None, checkpoint=None, substitute=None, upcoming=(), engine=None, profile=None,
+                fixed=0):
+    """Normalize rồi ghép các clip thành output_path.
+
+    streaming=True: clip được encode thành segment MPEG-TS và đẩy vào ffmpeg ghép
+    theo thứ tự ngay khi xong, không tạo file MP4 trung gian.
+    on_progress(snapshot): nhận ước lượng ETA (xem ConcatEstimate) mỗi khi xong một clip.
+    checkpoint: JobCheckpoint ghi lại từng segment đã xong (segment nằm trong cache nên
+    lần chạy lại lấy được ngay). Output được ghi ra file .part rồi mới đổi tên.
+    substitute(bad_path, exclude): trả về clip thay thế khi một clip hỏng (None = không có).
+    Clip hỏng bị quarantine trong index (clip chỉ mất file thì không); không thay được thì huỷ
+    các encode còn lại của output.
+    fixed: số clip đầu playlist do dòng sheet chỉ định (first/second/third vids), không bao giờ
+    bị thay: clip cố định lỗi thì output lỗi.
+    upcoming: clip của output kế tiếp, được copy trước về local ngay sau clip của output này.
+    engine: ENGINE_SEGMENTS / ENGINE_FILTERGRAPH / "auto"; None theo CONCAT_ENGINE (pick_concat_engine).
+    Filtergraph lỗi thì ghép lại theo segment, để tìm và thay được clip hỏng.
+    profile: tham số encoder của kênh (use_nvenc, cq, v_bitrate, a_bitrate), cũng là một phần key cache.
+    Trả về danh sách clip thực sự đã ghép.
+    """
+    input_videos = list(input_videos)
+    cache = get_clip_cache() if use_cache else None
+    prefetcher = get_prefetcher()
+    sources = []
+    cancel = CancelScope()
+    profile = dict(profile or {})
+    params = normalize_params(**profile)
+    container, ext = ("mpegts", ".ts") if streaming else ("mp4", ".mp4")
     normalized_paths = []
+    cached_paths = []
+    metrics = get_metrics()
+    modes = {}
+
+    # ước lượng dung lượng cần: clip normalize có bitrate cỡ file nguồn
+    estimate = sum(os.path.getsize(p) for p in input_videos if os.path.exists(p))
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    os.makedirs(output_dir, exist_ok=True)
+    check_free_space(output_dir, estimate)
+
+    # probe + phân loại trước, để biết chi phí từng clip trước khi xếp lịch
+    with metrics.timer("probe", channel=channel, clips=len(input_videos)):
+        infos = get_probe_service().probe_many(input_videos)
+
+    def clip_mode(path, info):
+        mode = classify_clip(info, path, params["width"], params["height"], params["fps"])
+        if mode == CLIP_COPY and streaming:
+            # clip đã đúng chuẩn: chỉ cần remux sang TS (rẻ, không cache)
+            return CLIP_REMUX
+        return mode
+
+    def plan_clip(path, info):
+        mode = classify_clip(info, path, params["width"], params["height"], params["fps"])
+        modes[mode] = modes.get(mode, 0) + 1
+        print(f"[{mode.upper()}] {path}")
+        mode = clip_mode(path, info)
+        return mode, estimate_cost(info, mode, params["width"], params["height"], params["fps"])
+
+    def cache_params(mode):
+        key_params = {**params, "mode": mode}
+        if streaming:
+            key_params["container"] = container
+        return key_params
+
+    def needs_source(path, mode):
+        """ffmpeg phải đọc file nguồn: clip dùng nguyên file, hoặc chưa có trong cache normalize."""
+        if mode == CLIP_COPY or cache is None or (streaming and mode == CLIP_REMUX):
+            return True
+        try:
+            return cache.lookup(path, cache_params(mode), ext) is None
+        except OSError:
+            return True
+
+    def uncached(paths):
+        """Các clip (của output kế tiếp) cần copy nguồn về trước, theo cùng profile."""
+        paths = [p for p in paths if prefetcher.is_remote(p)]
+        infos = get_probe_service().probe_many(paths)
+        return [p for p in paths if has_video(infos[p]) and needs_source(p, clip_mode(p, infos[p]))]
+
+    def replace_bad_clip(i, path, error, fault, attempt):
+        reason = error_reason(error)
+        print(f"[BAD] {path}: {reason}")
+        if fault == CLIP_BROKEN:
+            get_probe_service().quarantine(path, reason)
+        metrics.record("bad_clip", channel=channel, clip=path, error=reason, fault=fault)
+        if i < fixed or substitute is None or attempt >= MAX_SUBSTITUTES:
+            return None
+        replacement = substitute(path, exclude=list(input_videos))
+        if replacement is None:
+            return None
+        print(f"[SUBSTITUTE] {path} -> {replacement}")
+        input_videos[i] = replacement
+        if checkpoint is not None:
+            checkpoint.replace_clip(i, replacement)
+        return replacement
+
+    def unreplaced(i, path):
+        if i < fixed:
+            return RuntimeError(f"Clip cố định của dòng sheet bị lỗi, không thay: {path}")
+        return RuntimeError(f"Clip hỏng, không có clip thay thế: {path}")
 
-    def normalize_and_collect(i, path):
-        fixed = f"normalized_{i}.mp4"
-        normalize_video(path, fixed)
+    plans = []
+    plan_infos = []
+    for i, path in enumerate(input_videos):
+        info = infos[path]
+        attempt = 0
+        # clip ffprobe không đọc được: thay ngay, trước khi có encode nào chạy
+        while not has_video(info):
+            if not os.path.exists(path):
+                error, fault = FileNotFoundError(f"Không thấy file: {path}"), CLIP_MISSING
+            elif info is None:
+                # probe lỗi / timeout: không kết luận được là clip hỏng
+                error, fault = RuntimeError("ffprobe lỗi hoặc timeout"), CLIP_MISSING
+            else:
+                error, fault = RuntimeError("ffprobe không thấy stream video"), CLIP_BROKEN
+            replacement = replace_bad_clip(i, path, error, fault, attempt)
+            if replacement is None:
+                raise unreplaced(i, path) from error
+            path, attempt = replacement, attempt + 1
+            info = get_probe_service().probe(path)
+        plans.append(plan_clip(path, info))
+        plan_infos.append(info)
+    durations = sum(get_video_seconds(p) for p in input_videos)
+    if engine in (ENGINE_SEGMENTS, ENGINE_FILTERGRAPH):
+        cached = None
+    else:
+        # clip đã có trong cache normalize: segment path chỉ việc ghép, filtergraph vẫn encode lại
+        cached = [not needs_source(path, mode) for path, (mode, _) in zip(input_videos, plans)]
+    engine = pick_concat_engine(plans, plan_infos, streaming, engine, use_nvenc=profile.get("use_nvenc", True),
+                                cached=cached)
+    if engine == ENGINE_FILTERGRAPH:
+        progress = ConcatEstimate(filtergraph_cost(plan_infos), on_progress)
+    else:
+        progress = ConcatEstimate(sum(cost for _, cost in plans) + durations * REMUX_COST_FACTOR, on_progress)
+
+    def report(snapshot):
+        if snapshot["eta"]:
+            print(f"[ETA] {snapshot['done_cost']:.0f}/{snapshot['total_cost']:.0f}, "
+                  f"còn ~{snapshot['eta_seconds']:.0f}s (xong lúc {snapshot['eta']})")
+
+    def normalize_and_collect(workdir, i, path, mode, cost):
+        for attempt in range(MAX_SUBSTITUTES + 1):
+            cancel.check()
+            try:
+                fixed = normalize_clip(workdir, i, path, mode, cost)
+                break
+            except Exception as e:
+                if cancel.cancelled:
+                    raise
+                fault = clip_fault(path, e)
+                if fault is None:
+                    cancel.cancel()
+                    raise
+                replacement = replace_bad_clip(i, path, e, fault, attempt)
+                if replacement is None:
+                    cancel.cancel()
+                    raise unreplaced(i, path) from e
+                old_cost, path = cost, replacement
+                mode, cost = plan_clip(path, probe_video_info(path))
+                progress.add_cost(cost - old_cost)
+        if checkpoint is not None and fixed != path:
+            checkpoint.segment_done(i, fixed)
+        report(progress.advance(cost))
         return fixed
 
-    with ThreadPoolExecutor(max_workers=8) as executor:
-        futures = [executor.submit(normalize_and_collect, i, path) for i, path in enumerate(input_videos)]
-        for future in futures:
-            normalized_paths.append(future.result())
+    queue_costs = [None] * len(input_videos)      # key xếp hàng trong scheduler, None = theo cost
+
+    def local_source(path):
+        # clip trên share mạng: đọc từ bản copy local (đã được prefetch từ trước)
+        source = prefetcher.acquire(path)
+        sources.append(source)
+        return source
+
+    def normalize_clip(workdir, i, path, mode, cost):
+        if mode == CLIP_COPY:
+            return local_source(path)
+        if cache is None or (streaming and mode == CLIP_REMUX):
+            fixed = os.path.join(workdir, f"normalized_{i}{ext}")
+            prepare_clip(path, fixed, mode, channel, container, cost, cancel, local_source(path), profile,
+                         scratch_dir, queue_costs[i])
+            return fixed
+        # cache hit thì không cần tới file nguồn: chỉ copy / chờ copy khi phải encode
+        fixed, hit = cache.get_or_create(
+            path, cache_params(mode),
+            lambda tmp: prepare_clip(path, tmp, mode, channel, container, cost, cancel, local_source(path),
+                                     profile, scratch_dir, queue_costs[i]),
+            ext=ext
+        )
+        cached_paths.append(fixed)
+        if hit:
+            modes["cache_hit"] = modes.get("cache_hit", 0) + 1
+            print(f"[CACHE] {path}")
+        return fixed
+
+    def concat_in_one_pass():
+        prefetcher.prefetch(input_videos)
+        prefetcher.prefetch(uncached(upcoming))
+        local = [local_source(path) for path in input_videos]
+        done = [0.0]
+
+        def on_encode_progress(summary):
+            # tiến độ theo số giây output đã encode
+            if durations and "out_seconds" in summary:
+                cost = progress.total * min(summary["out_seconds"] / durations, 1.0)
+                if cost > done[0]:
+                    report(progress.advance(cost - done[0]))
+                    done[0] = cost
 
-    concat_video(normalized_paths, output_path)
+        concat_filtergraph(local, part_path, plan_infos, channel, progress.total, on_encode_progress, cancel,
+                           **profile)
 
-    for path in normalized_paths:
-        os.remove(path)
+    root, out_ext = os.path.splitext(output_path)
+    part_path = f"{root}.part{out_ext}"
+    try:
+        with metrics.timer("job", channel=channel, output=output_path, clips=len(input_videos),
+                           streaming=streaming, bytes_in=estimate, modes=modes,
+                           cost=round(progress.total, 1)) as job, \
+                job_workspace(0 if cache else estimate, root=scratch_dir) as workdir:
+            job["engine"] = engine
+            if engine == ENGINE_FILTERGRAPH:
+                print(f"[ENGINE] filtergraph: {len(input_videos)} clip trong một lệnh ffmpeg")
+                try:
+                    concat_in_one_pass()
+                except subprocess.CalledProcessError as e:
+                    if cancel.cancelled:
+                        raise
+                    print(f"[WARN] Ghép bằng filtergraph lỗi ({error_reason(e)}), ghép lại theo segment")
+                    engine = job["engine"] = ENGINE_SEGMENTS
+                    job["engine_fallback"] = True
+                    progress = ConcatEstimate(sum(cost for _, cost in plans) + durations * REMUX_COST_FACTOR,
+                                              on_progress)
+            if engine == ENGINE_SEGMENTS:
+                # số ffmpeg chạy thật sự do encode scheduler quyết định; futures giữ thứ tự playlist
+                futures = [None] * len(input_videos)
+                if streaming:
+                    # mux đọc segment theo thứ tự playlist: clip đầu chặn mọi clip sau nó, nên vào
+                    # trước. Key xếp hàng = chi phí từ clip đó tới hết playlist (giảm dần theo vị trí,
+                    # cùng đơn vị với cost của các output khác trong scheduler)
+                    order = list(range(len(input_videos)))
+                    queue_costs[:] = list(itertools.accumulate(cost for _, cost in reversed(plans)))[::-1]
+                else:
+                    # clip tốn nhất được đưa vào trước (LPT)
+                    order = sorted(range(len(input_videos)), key=lambda i: -plans[i][1])
+                # copy nguồn từ share chạy song song với encode, theo đúng thứ tự sẽ encode;
+                # clip đã có trong cache normalize thì không copy
+                prefetcher.prefetch([input_videos[i] for i in order if needs_source(input_videos[i], plans[i][0])])
+                prefetcher.prefetch(uncached(upcoming))
+                with ThreadPoolExecutor(max_workers=max(1, min(len(input_videos), MAX_CLIP_WORKERS))) as executor:
+                    for i in order:
+                        futures[i] = executor.submit(normalize_and_collect, workdir, i, input_videos[i], *plans[i])
+                    if streaming:
+                        stream_concat(futures, part_path, workdir, channel)
+                    else:
+                        for future in futures:
+                            normalized_paths.append(future.result())
+
+                if not streaming:
+                    concat_video(normalized_paths, part_path, channel, workdir)
+                progress.advance(durations * REMUX_COST_FACTOR)
+            # output chỉ xuất hiện khi đã ghép xong hoàn toàn
+            os.replace(part_path, output_path)
+            job["bytes_out"] = _file_size(output_path)
+    finally:
+        for path in cached_paths:
+            cache.unpin(path)
+        for source in sources:
+            prefetcher.release(source)
+        if os.path.exists(part_path):
+            os.remove(part_path)
 
     print("Ghép video hoàn tất:", output_path)
+    return input_videos
+
+def produce_output(selected_files, output_path, channel, used_store, checkpoint=None, **kwargs):
+    """Ghép một output rồi ghi trạng thái used của nó.
+
+    Có checkpoint thì chạy lại được: dùng lại clip đã chọn, bỏ qua bước đã xong.
+    Trả về danh sách clip thực sự dùng cho output.
+    """
+    if checkpoint is None:
+        selected_files = auto_concat(selected_files, output_path, channel=channel, **kwargs)
+        used_store.mark_used(selected_files)
+        return selected_files
+
+    selected_files = checkpoint.select(selected_files, output_path)
+    if checkpoint.output_ready():
+        print(f"[RESUME] Output đã ghép xong: {output_path}")
+    else:
+        selected_files = auto_concat(selected_files, output_path, channel=channel, checkpoint=checkpoint, **kwargs)
+        checkpoint.output_done(output_path)
+    if not checkpoint.used:
+        used_store.mark_used(selected_files)
+        checkpoint.used_done()
+    return selected_files
 
 # debug
 def print_video_info(video_path):
-    with open(LOG_FILE, "a", encoding="utf-8") as log:
-        log.write(f"\n🔍 Đang kiểm tra: {video_path}\n")
-
+    """Ghi JSON ffprobe của clip thành một record 'probe_info' trong command log."""
     try:
-        cmd = [
-            "ffprobe", "-v", "error",
-            "-print_format", "json",
-            "-show_streams", "-show_format",
-            video_path
-        ]
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        info = json.loads(result.stdout or "{}")
-
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(json.dumps(info, indent=2, ensure_ascii=False))
-            log.write("\n")
+        info = probe_video_info(video_path)
+        get_command_log().write("probe_info", path=video_path, info=info)
     except Exception as e:
-        with open(LOG_FILE, "a", encoding="utf-8") as log:
-            log.write(f"Lỗi khi đọc thông tin video: {e}\n")
+        get_command_log().write("error", where="print_video_info", path=video_path, error=str(e))
 
 
 import pandas as pd
@@ -203,52 +1236,156 @@ def update_row_to_sheet(row_index, df_row, sheet_file, worksheet_index):
 
     gs_row = row_index + 2
 
-    values = df_row.astype(str).fillna('').tolist()
+    values = row_values(df_row)
 
     worksheet.update(f'A{gs_row}', [values])
     print(f"Updated google sheet row {gs_row}")
-    
 
 
+def row_values(df_row):
+    return df_row.astype(str).fillna('').tolist()
 
 
-def clear_excel_file(excel_file):
-    try:
-        columns = ['first vids', 'desired length', 'output directory', 'number_of_vids', 'status']
-        empty_df = pd.DataFrame(columns=columns)
-        empty_df.to_excel(excel_file, index=False, engine='openpyxl')
-        print(f"Cleared existing content in Excel file: {excel_file}")
-    except Exception as e:
-        print(f"Error clearing Excel file '{excel_file}': {e}")
+RETRY_STATUS = {429, 500, 502, 503}
 
-def copy_from_ggsheet_to_excel(gspread_client, sheet_name, excel_file,sheet_index):
-    try:
-        spreadsheet = gspread_client.open(sheet_name)
-        worksheet = spreadsheet.get_worksheet(sheet_index)
-        data = worksheet.get_all_values()
-
-        if not data:
-            print("Google Sheet is empty!")
-            return
-        
-        columns = data[0]  
-        values = data[1:]  
-        df = pd.DataFrame(values, columns=columns)
-        clear_excel_file(excel_file)
-        df.to_excel(excel_file, index=False, engine='openpyxl')
-        print(f"Successfully copied data from Google {sheet_name} to Excel file {excel_file}")
-    except Exception as e:
-        print(f"Error copying data from Google Sheet to Excel: {e}")
 
-def pre_process_data(file):
-    df = pd.read_excel(file)
+def _api_status(error):
+    response = getattr(error, "response", None)
+    return getattr(response, "status_code", None) or getattr(error, "code", None)
+
+
+class SheetSink:
+    """Gom các update dòng của một worksheet và ghi bằng batch_update.
+
+    Dùng lại worksheet đã mở, flush theo chu kỳ `flush_interval` giây (thread nền)
+    hoặc khi close(). Lỗi quota/5xx được thử lại với backoff tăng dần.
+    `worksheet` chỉ cần có batch_update(data) nên test được bằng worksheet giả.
+    Nếu có `journal`, mọi update được ghi vào journal trước và update chưa flush của
+    lần chạy trước được nạp lại.
+    """
+
+    def __init__(self, worksheet, flush_interval=30, max_retries=5, backoff=2.0, sleep=time.sleep,
+                 journal=None):
+        self.worksheet = worksheet
+        self.journal = journal
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.sleep = sleep
+        self._pending = pending_sheet_rows(journal) if journal else {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        if flush_interval:
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"Error updating Google Sheet: {e}")
+
+    def update_row(self, row_index, df_row):
+        """row_index là index của DataFrame (dòng sheet = row_index + 2)."""
+        self.update_values(row_index + 2, row_values(df_row))
+
+    def update_values(self, gs_row, values):
+        with self._lock:
+            if self.journal:
+                self.journal.append("row", row=gs_row, values=values)
+            self._pending[gs_row] = values
+
+    def _batch_update(self, data):
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.worksheet.batch_update(data)
+            except Exception as e:
+                if _api_status(e) not in RETRY_STATUS or attempt == self.max_retries:
+                    raise
+                delay = self.backoff * (2 ** attempt)
+                print(f"Google Sheet quota/server error, retry in {delay:.0f}s ...")
+                self.sleep(delay)
+
+    def flush(self):
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            data = [{"range": f"A{gs_row}", "values": [values]} for gs_row, values in sorted(pending.items())]
+            try:
+                self._batch_update(data)
+            except Exception:
+                # giữ lại để lần flush sau ghi tiếp (update mới hơn được ưu tiên)
+                with self._lock:
+                    for gs_row, values in pending.items():
+                        self._pending.setdefault(gs_row, values)
+                raise
+            if self.journal:
+                with self._lock:
+                    if self._pending:
+                        self.journal.append("flushed", rows=sorted(pending))
+                    else:
+                        self.journal.clear()
+            print(f"Updated google sheet rows {', '.join(str(r) for r in sorted(pending))}")
+            return len(pending)
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+
+
+
+def sheet_to_dataframe(data):
+    """get_all_values() -> DataFrame (ô trống giữ là chuỗi rỗng)."""
+    if not data:
+        return pd.DataFrame(columns=['first vids', 'desired length', 'output directory', 'status'])
+    columns = data[0]
+    width = len(columns)
+    values = [(row + [''] * width)[:width] for row in data[1:]]
+    return pd.DataFrame(values, columns=columns)
+
+
+def pre_process_df(df):
+    def filled(column):
+        return df[column].notna() & df[column].astype(str).str.strip().ne('')
+
     filtered_df = df[
-        df['first vids'].notna() &
-        df['desired length'].notna() &
-        df['status'].str.lower().eq('auto')
+        filled('first vids') &
+        filled('desired length') &
+        df['status'].astype(str).str.strip().str.lower().eq('auto')
     ]
     return filtered_df, df
 
+
+def load_job_table(worksheet, values=None):
+    """Đọc bảng job thẳng từ worksheet (không qua file Excel).
+
+    values: giá trị đã đọc sẵn (SpreadsheetSnapshot), khỏi gọi get_all_values().
+    """
+    return pre_process_df(sheet_to_dataframe(worksheet.get_all_values() if values is None else values))
+
+
+def pre_process_data(file):
+    return pre_process_df(pd.read_excel(file))
+
+
+def flush_pending_updates(worksheet, journal):
+    """Ghi nốt các update sheet còn trong journal từ lần chạy bị dừng giữa chừng."""
+    SheetSink(worksheet, flush_interval=0, journal=journal).close()
+
 def convert_time_to_seconds(time_str):
     try:
         if isinstance(time_str, (int, float)):
@@ -266,27 +1403,112 @@ def convert_time_to_seconds(time_str):
     except:
         return 0
     
+def parse_durations(values):
+    """Bản vector hoá của convert_time_to_seconds: "h:mm:ss" / "m:ss" / "ss" / số -> giây (float)."""
+    series = pd.Series(values)
+    if pd.api.types.is_numeric_dtype(series):
+        return series.fillna(0).to_numpy(dtype=np.float64)
+    parts = series.astype(str).str.strip().str.split(':', n=2, expand=True)
+    parts = parts.reindex(columns=range(3))
+    nums = parts.apply(pd.to_numeric, errors='coerce').to_numpy(dtype=np.float64)
+    given = parts.notna().to_numpy().sum(axis=1)
+    seconds = np.select(
+        [given == 3, given == 2, given == 1],
+        [nums[:, 0] * 3600 + nums[:, 1] * 60 + nums[:, 2], nums[:, 0] * 60 + nums[:, 1], nums[:, 0]],
+        default=0.0,
+    )
+    return np.nan_to_num(seconds, nan=0.0)
+
+
+CLIP_TABLE_DTYPES = {
+    "file_path": "string",
+    "duration_sec": "float64",
+    "vcodec": "category",
+    "profile": "category",
+    "width": "Int32",
+    "height": "Int32",
+    "fps": "float32",
+    "acodec": "category",
+    "sample_rate": "Int32",
+}
+
+
 def prepare_original_data(csv_file):
+    """Đọc CSV thư viện thành bảng clip: (durations float64, file_paths, DataFrame có kiểu)."""
     try:
-        df = pd.read_csv(csv_file, encoding='utf-8-sig')
-        durations = np.array([convert_time_to_seconds(d) for d in df['duration']])
-        file_paths = df['file_path'].tolist()
+        header = pd.read_csv(csv_file, encoding='utf-8-sig', nrows=0).columns
+        dtypes = {c: t for c, t in CLIP_TABLE_DTYPES.items() if c in header}
+        df = pd.read_csv(csv_file, encoding='utf-8-sig', dtype=dtypes)
+        if 'duration_sec' in df.columns:
+            durations = df['duration_sec'].to_numpy(dtype=np.float64, na_value=np.nan, copy=True)
+            missing = np.isnan(durations)
+            if missing.any():
+                durations[missing] = parse_durations(df.loc[missing, 'duration'])
+        else:
+            durations = parse_durations(df['duration'])
+        file_paths = [sys.intern(p) for p in df['file_path'].astype(str)]
         return durations, file_paths, df
     except FileNotFoundError:
         print(f"Error: CSV file '{csv_file}' not found.")
-        return None, None, None, None
+        return None, None, None
     except KeyError as e:
         print(f"Error: Missing column {e} in the CSV file.")
-        return None, None, None, None
+        return None, None, None
     except Exception as e:
         print(f"Unexpected error reading CSV: {str(e)}")
-        return None, None, None, None
-    
-def generate_video_lists(suitable_df, durations, file_paths, used_video_paths, num_lists=1):
+        return None, None, None
+
+def generate_video_lists(suitable_df, durations, file_paths, used_video_paths, num_lists=1,
+                         seed=None, fit=False, tolerance=30, release_used=None):
+    """release_used(): các path được dùng lại khi hết video (mặc định: xoá toàn bộ log)."""
 
     results = []
     newly_used_paths = set()
 
+    def reset_used():
+        if release_used is None:
+            print("Đã dùng hết video, reset log.")
+            used_video_paths.clear()
+            paths = file_paths
+        else:
+            paths = release_used()
+            print(f"Đã dùng hết video, dùng lại {len(paths)} video lâu chưa dùng.")
+        # không chọn lại video đã chọn trong lần chạy này
+        return [p for p in paths if p not in newly_used_paths] or paths
+
+    sampler = ClipSampler(durations, file_paths, used_video_paths, seed=seed, on_exhausted=reset_used)
+    positions = {}
+    # substitute được gọi đồng thời từ các worker của auto_concat và từ nhiều output của kênh:
+    # sampler và newly_used_paths không thread-safe, hai clip hỏng cùng lúc không được nhận cùng một clip
+    substitute_lock = threading.Lock()
+
+    def substitute(bad_path, exclude=()):
+        """Clip thay cho clip hỏng: chưa dùng, thời lượng gần nhất, không bị quarantine."""
+        with substitute_lock:
+            if not positions:
+                positions.update((p, i) for i, p in enumerate(file_paths))
+            i = positions.get(bad_path)
+        duration = float(durations[i]) if i is not None else get_video_seconds(bad_path)
+        probe = get_probe_service()
+        with substitute_lock:
+            blocked = set(exclude) | newly_used_paths
+            while True:
+                index = sampler.substitute(duration, exclude=blocked)
+                if index is None:
+                    return None
+                path = file_paths[index]
+                if not probe.is_quarantined(path):
+                    newly_used_paths.add(path)
+                    return path
+                blocked.add(path)
+
+    # probe song song một lần tất cả first/second/third vids (kết quả được cache)
+    fixed_columns = [c for c in ('first vids', 'second vids', 'third vids') if c in suitable_df.columns]
+    get_probe_service().probe_many([
+        str(v).strip().strip('"') for c in fixed_columns for v in suitable_df[c]
+        if pd.notna(v) and str(v).strip()
+    ])
+
     # Duyệt từng dòng trong suitable_df
     for group_index, (row_index, row) in enumerate(suitable_df.iterrows()):
         desired_length = float(row['desired length']) * 60
@@ -294,7 +1516,7 @@ def generate_video_lists(suitable_df, durations, file_paths, used_video_paths, n
 
         # Lấy video đầu
         first_vd = find_first_vid(first_vid_number)
-        first_path, first_duration = first_vd[0], convert_time_to_seconds(first_vd[1])
+        first_path, first_duration = first_vd[0], get_video_seconds(first_vd[0])
         if not first_path:
             print(f"Không tìm thấy video đầu tiên cho {first_vid_number}")
             continue
@@ -314,17 +1536,6 @@ def generate_video_lists(suitable_df, durations, file_paths, used_video_paths, n
                 third_vid = str(tv).strip().strip('"')
 
         for list_index in range(num_lists):
-            # Chọn các index chưa dùng trong log
-            available_indexes = [
-                idx for idx in range(len(file_paths))
-                if file_paths[idx] not in used_video_paths
-            ]
-
-            if not available_indexes:
-                print("Đã dùng hết video, reset log.")
-                used_video_paths.clear()
-                available_indexes = list(range(len(file_paths)))
-
             total_duration = first_duration
             selected_paths = [first_path]
             newly_used_paths.add(first_path)
@@ -332,33 +1543,32 @@ def generate_video_lists(suitable_df, durations, file_paths, used_video_paths, n
             # Thêm second vids
             if second_vid:
                 selected_paths.append(second_vid)
-                total_duration += convert_time_to_seconds(get_video_duration(second_vid))
+                total_duration += get_video_seconds(second_vid)
                 newly_used_paths.add(second_vid)
 
             # Thêm third vids
             if third_vid:
                 selected_paths.append(third_vid)
-                total_duration += convert_time_to_seconds(get_video_duration(third_vid))
+                total_duration += get_video_seconds(third_vid)
                 newly_used_paths.add(third_vid)
 
             # Thêm random các video khác cho tới khi đủ desired_length
-            while available_indexes and total_duration < desired_length:
-                chosen_index = random.choice(available_indexes)
+            picked, total_duration = sampler.fill(
+                desired_length, total_duration, exclude=selected_paths, fit=fit, tolerance=tolerance
+            )
+            for chosen_index in picked:
                 path = file_paths[chosen_index]
-
-                if path not in used_video_paths:
-                    total_duration += durations[chosen_index]
-                    selected_paths.append(path)
-                    newly_used_paths.add(path)
-
-                available_indexes.remove(chosen_index)
+                selected_paths.append(path)
+                newly_used_paths.add(path)
 
             results.append({
                 'name': first_vid_number,
+                'fixed': 1 + bool(second_vid) + bool(third_vid),  # clip do sheet chỉ định, không được thay
                 'group_index': group_index,  # dùng lại trong main để map sang original_df
                 'list_number': list_index + 1,
                 'selected_files': selected_paths,
-                'total_duration': total_duration
+                'total_duration': total_duration,
+                'substitute': substitute,  # chọn clip thay thế khi một clip bị hỏng lúc ghép
             })
 
     return results, newly_used_paths
@@ -0,0 +1,96 @@
+import os
+import time
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from clip_cache import NormalizedClipCache
+
+# === Cache clip nguồn trên ổ local (cho thư viện nằm trên share mạng / ổ chậm) ===
+SOURCE_CACHE_DIR = os.environ.get("CONCAT_SOURCE_CACHE_DIR", os.path.join("cache", "sources"))
+SOURCE_CACHE_MAX_GB = float(os.environ.get("CONCAT_SOURCE_CACHE_MAX_GB", "100"))
+# các thư mục gốc cần copy về trước (ngăn cách bởi os.pathsep); đường dẫn UNC (\\server\share)
+# luôn được copy
+PREFETCH_ROOTS = tuple(p for p in os.environ.get("CONCAT_PREFETCH_ROOTS", "").split(os.pathsep) if p)
+PREFETCH_WORKERS = int(os.environ.get("CONCAT_PREFETCH_WORKERS", "2"))
+SOURCE_PARAMS = {"source": 1}
+
+
+def copy_file(src, dst, chunk_size=8 * 1024 * 1024):
+    with open(src, "rb") as fin, open(dst, "wb") as fout:
+        shutil.copyfileobj(fin, fout, chunk_size)
+
+
+class SourcePrefetcher:
+    """Copy trước clip nguồn về cache local, để ffmpeg không đọc qua SMB trong lúc encode.
+
+    prefetch() xếp hàng copy (tối đa `max_workers` file cùng lúc) cho các clip sắp dùng;
+    acquire() trả về bản copy local (chờ nếu đang copy) và pin nó cho tới release().
+    Cache giới hạn dung lượng, xoá theo LRU như cache clip đã normalize.
+    """
+
+    def __init__(self, cache_dir=SOURCE_CACHE_DIR, max_bytes=int(SOURCE_CACHE_MAX_GB * 1024 ** 3),
+                 roots=None, max_workers=PREFETCH_WORKERS, on_copied=None):
+        self.cache = NormalizedClipCache(cache_dir, max_bytes)
+        self.roots = tuple(os.path.join(os.path.abspath(r), "") for r in (PREFETCH_ROOTS if roots is None else roots))
+        self.on_copied = on_copied
+        self._executor = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="prefetch")
+        self._futures = {}
+        self._lock = threading.Lock()
+
+    def is_remote(self, path):
+        if path.startswith(("\\\\", "//")):
+            return True
+        return bool(self.roots) and os.path.abspath(path).startswith(self.roots)
+
+    def _copy(self, path):
+        start = time.perf_counter()
+        local, hit = self.cache.get_or_create(
+            path, SOURCE_PARAMS, lambda tmp: copy_file(path, tmp), ext=os.path.splitext(path)[1].lower()
+        )
+        self.cache.unpin(local)
+        if not hit and self.on_copied:
+            self.on_copied(path, os.path.getsize(local), time.perf_counter() - start)
+        return local
+
+    def _submit(self, path):
+        with self._lock:
+            future = self._futures.get(path)
+            if future is not None:
+                return future
+            future = self._futures[path] = self._executor.submit(self._copy, path)
+        # ngoài lock: nếu future đã xong, callback chạy ngay trong thread này
+        future.add_done_callback(lambda f, p=path: self._done(p, f))
+        return future
+
+    def _done(self, path, future):
+        with self._lock:
+            if self._futures.get(path) is future:
+                del self._futures[path]
+
+    def prefetch(self, paths):
+        """Xếp hàng copy các clip ở xa theo thứ tự sẽ dùng (không chờ)."""
+        for path in paths:
+            if self.is_remote(path):
+                self._submit(path)
+
+    def acquire(self, path):
+        """Đường dẫn nên đưa cho ffmpeg: bản copy local (đã pin) hoặc chính path.
+
+        Copy lỗi thì đọc thẳng từ nguồn.
+        """
+        if not self.is_remote(path):
+            return path
+        try:
+            self._submit(path).result()
+            local, _ = self.cache.get_or_create(
+                path, SOURCE_PARAMS, lambda tmp: copy_file(path, tmp), ext=os.path.splitext(path)[1].lower()
+            )
+            return local
+        except OSError as e:
+            print(f"[WARN] Không copy được {path} về local: {e}")
+            return path
+
+    def release(self, local_path):
+        if os.path.dirname(os.path.abspath(local_path)) == os.path.abspath(self.cache.cache_dir):
+            self.cache.unpin(local_path)
@@ -0,0 +1,115 @@
+import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from library_index import LibraryIndex, stat_signature
+from proc_runner import get_process_runner
+
+# thread chỉ chờ kết quả; số ffprobe chạy thật sự do PROCESS_LIMITS["ffprobe"] giới hạn
+PROBE_WORKERS = 32
+# ffprobe treo (share mạng chập chờn) bị kill sau chừng này giây
+PROBE_TIMEOUT = int(os.environ.get("CONCAT_PROBE_TIMEOUT", 60))
+
+
+def run_ffprobe(path, timeout=PROBE_TIMEOUT):
+    cmd = [
+        "ffprobe", "-v", "error",
+        "-print_format", "json",
+        "-show_streams", "-show_format",
+        path
+    ]
+    # exit != 0 (file hỏng hoặc share lỗi giữa chừng) là probe lỗi, không phải kết quả
+    result = get_process_runner().run(cmd, timeout=timeout, capture_stdout=True, check=True)
+    return json.loads(result.stdout or "{}")
+
+
+class ProbeService:
+    """Probe dùng chung cho cả pipeline, mỗi phiên bản file chỉ chạy ffprobe một lần.
+
+    Kết quả được nhớ trong RAM và lưu vào library index (SQLite), key theo
+    path + size + mtime, nên các process/lần chạy sau cũng không phải probe lại.
+    """
+
+    def __init__(self, index=None, runner=run_ffprobe, max_workers=PROBE_WORKERS):
+        self.index = index
+        self.runner = runner
+        self.max_workers = max_workers
+        self._memo = {}
+        self._lock = threading.Lock()
+        self._inflight = {}
+
+    def probe(self, path):
+        """JSON ffprobe (streams + format) của file; None nếu probe lỗi (stat lỗi, timeout,
+        ffprobe exit != 0). Kết quả lỗi không được nhớ hay lưu vào index, lần sau probe lại."""
+        try:
+            sig = stat_signature(path)
+        except OSError:
+            return None
+        with self._lock:
+            cached = self._memo.get(path)
+            if cached and cached[0] == sig:
+                return cached[1]
+            # hai thread cùng probe một file: thread sau chờ kết quả của thread trước
+            event = self._inflight.get(path)
+            owner = event is None
+            if owner:
+                event = self._inflight[path] = threading.Event()
+        if not owner:
+            event.wait()
+            return self.probe(path)
+
+        try:
+            info = self.index.lookup(path, *sig) if self.index else None
+            if info is None:
+                try:
+                    info = self.runner(path)
+                except Exception as e:
+                    # lỗi tạm thời (timeout, share mất kết nối): không lưu, lần sau probe lại
+                    print(f"[ERR] probe {path}: {e}")
+                    return None
+                if info is None:
+                    return None
+                if self.index:
+                    self.index.upsert("", path, *sig, info)
+            with self._lock:
+                self._memo[path] = (sig, info)
+            return info
+        finally:
+            with self._lock:
+                self._inflight.pop(path, None)
+            event.set()
+
+    def probe_many(self, paths):
+        """Probe nhiều file song song (bỏ trùng). Trả về dict path -> JSON (None nếu lỗi)."""
+        unique = list(dict.fromkeys(paths))
+        if len(unique) <= 1:
+            return {p: self.probe(p) for p in unique}
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(unique))) as executor:
+            return dict(zip(unique, executor.map(self.probe, unique)))
+
+    def quarantine(self, path, reason):
+        """Đánh dấu clip hỏng trong index để không được chọn lại."""
+        if self.index:
+            self.index.quarantine(path, reason)
+
+    def is_quarantined(self, path):
+        return bool(self.index) and self.index.is_quarantined(path)
+
+    def duration(self, path):
+        try:
+            return float((self.probe(path) or {}).get("format", {}).get("duration", 0.0) or 0.0)
+        except (TypeError, ValueError):
+            return 0.0
+
+
+_service = None
+_service_lock = threading.Lock()
+
+
+def get_probe_service():
+    global _service
+    with _service_lock:
+        if _service is None:
+            _service = ProbeService(LibraryIndex())
+        return _service
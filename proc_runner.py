@@ -0,0 +1,186 @@
+import os
+import asyncio
+import threading
+import subprocess
+from collections import deque
+
+# số process chạy cùng lúc theo chương trình; số ffmpeg encode do EncodeScheduler quyết định
+PROCESS_LIMITS = {
+    "ffprobe": int(os.environ.get("CONCAT_PROBE_CONCURRENCY", 32)),
+}
+STDERR_TAIL_LINES = 20
+LINE_LIMIT = 1024 * 1024        # độ dài tối đa một dòng đọc từ pipe
+
+
+def program_name(cmd):
+    return os.path.splitext(os.path.basename(cmd[0]))[0].lower()
+
+
+class ProcessHandle:
+    """Process đang chạy trên event loop của ProcessRunner.
+
+    kill() gọi được từ thread bất kỳ, nên đăng ký được vào CancelScope như một Popen.
+    """
+
+    def __init__(self, loop):
+        self._loop = loop
+        self.proc = None
+        self.killed = False
+
+    def kill(self):
+        self.killed = True
+        self._loop.call_soon_threadsafe(self._kill)
+
+    def _kill(self):
+        if self.proc is not None and self.proc.returncode is None:
+            try:
+                self.proc.kill()
+            except ProcessLookupError:
+                pass
+
+
+class ProcessRunner:
+    """Chạy ffmpeg/ffprobe trên một event loop asyncio dùng chung (thread nền riêng).
+
+    Mọi pipe của mọi process được đọc trên cùng một loop thay vì mỗi process một thread
+    đọc; thread gọi run() chỉ chờ kết quả. Hỗ trợ:
+      - timeout: tổng thời gian chạy tối đa (giây)
+      - idle_timeout: kill nếu process không ghi gì ra stdout/stderr trong chừng đó giây
+        (ffmpeg có -progress ghi mỗi ~0.5s, nên im lặng lâu nghĩa là bị treo, ví dụ share mạng)
+      - giới hạn số process cùng lúc theo chương trình (semaphore, PROCESS_LIMITS)
+      - on_stdout / on_stderr(line): nhận từng dòng ngay khi process ghi ra
+    Hết giờ thì process bị kill và raise subprocess.TimeoutExpired.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(PROCESS_LIMITS if limits is None else limits)
+        self._loop = None
+        self._semaphores = {}
+        self._lock = threading.Lock()
+
+    @property
+    def loop(self):
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="proc-runner", daemon=True).start()
+                self._loop = loop
+            return self._loop
+
+    def _semaphore(self, name):
+        # chỉ gọi trong thread của loop
+        if name not in self.limits:
+            return None
+        semaphore = self._semaphores.get(name)
+        if semaphore is None:
+            semaphore = self._semaphores[name] = asyncio.Semaphore(max(1, self.limits[name]))
+        return semaphore
+
+    @staticmethod
+    async def _reap(proc, timeout=5):
+        # process bị kill: nếu process con của nó còn giữ pipe thì wait() không trả về, nên không chờ mãi
+        try:
+            return await asyncio.wait_for(proc.wait(), timeout)
+        except asyncio.TimeoutError:
+            return proc.returncode
+
+    async def run_async(self, cmd, timeout=None, idle_timeout=None, on_stdout=None, on_stderr=None,
+                        capture_stdout=False, check=False, handle=None, **kwargs):
+        """Coroutine chạy cmd, trả về CompletedProcess (stderr là các dòng cuối của stderr)."""
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphore(program_name(cmd))
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE, stderr=subprocess.PIPE,
+                limit=LINE_LIMIT, **kwargs
+            )
+            if handle is not None:
+                handle.proc = proc
+                if handle.killed:
+                    proc.kill()
+            stdout = [] if capture_stdout else None
+            tail = deque(maxlen=STDERR_TAIL_LINES)
+            last_output = [loop.time()]
+
+            async def pump(stream, callback, keep):
+                while True:
+                    line = await stream.readline()
+                    if not line:
+                        return
+                    last_output[0] = loop.time()
+                    text = line.decode("utf-8", "replace")
+                    if keep is not None:
+                        keep.append(text)
+                    if callback:
+                        callback(text)
+
+            readers = asyncio.ensure_future(asyncio.gather(
+                pump(proc.stdout, on_stdout, stdout), pump(proc.stderr, on_stderr, tail)
+            ))
+            deadline = None if timeout is None else loop.time() + timeout
+            timed_out = None
+            try:
+                while not readers.done():
+                    now = loop.time()
+                    waits = []
+                    if deadline is not None:
+                        waits.append(deadline - now)
+                    if idle_timeout:
+                        waits.append(last_output[0] + idle_timeout - now)
+                    if waits and min(waits) <= 0:
+                        timed_out = timeout if deadline is not None and now >= deadline else idle_timeout
+                        proc.kill()
+                        break
+                    await asyncio.wait({readers}, timeout=min(waits) if waits else None)
+                if timed_out is None:
+                    returncode = await proc.wait()
+                else:
+                    returncode = await self._reap(proc)
+            except asyncio.CancelledError:
+                if proc.returncode is None:
+                    proc.kill()
+                    await self._reap(proc)
+                raise
+            finally:
+                if not readers.done():
+                    readers.cancel()
+                    try:
+                        await readers
+                    except asyncio.CancelledError:
+                        pass
+        finally:
+            if semaphore is not None:
+                semaphore.release()
+
+        output = "".join(stdout) if stdout is not None else None
+        if timed_out is not None:
+            raise subprocess.TimeoutExpired(cmd, timed_out, output=output, stderr="".join(tail))
+        if check and returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, output=output, stderr="".join(tail))
+        return subprocess.CompletedProcess(cmd, returncode, output, "".join(tail))
+
+    def run(self, cmd, cancel=None, **kwargs):
+        """Chạy cmd trên loop chung và chặn thread gọi tới khi xong (tham số như run_async).
+
+        cancel: CancelScope; process bị kill khi scope bị huỷ. Các callback chạy trên
+        thread của loop nên phải nhanh (parse dòng, ghi log).
+        """
+        loop = self.loop
+        handle = ProcessHandle(loop)
+        if cancel is not None:
+            cancel.register(handle)
+        try:
+            future = asyncio.run_coroutine_threadsafe(self.run_async(cmd, handle=handle, **kwargs), loop)
+            return future.result()
+        finally:
+            if cancel is not None:
+                cancel.unregister(handle)
+
+
+_runner = ProcessRunner()
+
+
+def get_process_runner():
+    return _runner
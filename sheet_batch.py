@@ -0,0 +1,127 @@
+import time
+import json
+import hashlib
+import threading
+
+# các kênh tới hạn trong cùng một vòng (trong MAX_AGE giây) dùng chung một lần đọc
+MAX_AGE = 20
+
+
+def a1_sheet(title):
+    """Tên worksheet dạng A1 ('Sheet 1' -> "'Sheet 1'"), dùng làm range của cả sheet."""
+    return "'" + title.replace("'", "''") + "'"
+
+
+def values_digest(values):
+    return hashlib.sha1(json.dumps(values, ensure_ascii=False).encode("utf-8")).hexdigest()
+
+
+def has_auto_rows(values):
+    """Có dòng status='auto' với 'first vids' và 'desired length' không rỗng (như pre_process_df).
+
+    Thiếu cột thì trả về True để kênh vẫn chạy và báo lỗi như trước.
+    """
+    if len(values) < 2:
+        return False
+    header = values[0]
+    try:
+        status, first, length = header.index("status"), header.index("first vids"), header.index("desired length")
+    except ValueError:
+        return True
+
+    def cell(row, i):
+        return str(row[i]).strip() if i < len(row) else ""
+
+    return any(
+        cell(row, status).lower() == "auto" and cell(row, first) and cell(row, length)
+        for row in values[1:]
+    )
+
+
+class SpreadsheetSnapshot:
+    """Đọc mọi worksheet cần dùng của một spreadsheet bằng một lần values_batch_get.
+
+    Mỗi worksheet giữ hash của lần đọc trước: nội dung không đổi thì dùng lại kết quả kiểm
+    tra dòng 'auto', khỏi dựng lại DataFrame. Kênh không có dòng 'auto' được bỏ qua mà
+    không đọc CSV thư viện hay probe gì.
+    open_spreadsheet() trả về gspread.Spreadsheet, hoặc object giả chỉ cần có
+    worksheets() (phần tử có .index, .title) và values_batch_get(ranges), nên test được
+    bằng spreadsheet giả trên máy.
+    """
+
+    def __init__(self, open_spreadsheet, sheet_indexes=None, max_age=MAX_AGE, clock=time.monotonic):
+        self.open_spreadsheet = open_spreadsheet
+        self.sheet_indexes = None if sheet_indexes is None else sorted(set(sheet_indexes))
+        self.max_age = max_age
+        self.clock = clock
+        self.fetches = 0
+        self._spreadsheet = None
+        self._worksheets = None
+        self._values = {}
+        self._digests = {}
+        self._auto = {}
+        self._fetched_at = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def invalidate(self):
+        """Lần hỏi sau đọc lại sheet (sau khi một kênh vừa ghi, hoặc khi wake).
+
+        Không lấy lock: gọi được cả khi đang có một lần đọc chạy dở; lần đọc đó không
+        được coi là mới (có thể đã đọc trước khi kênh ghi xong).
+        """
+        self._generation += 1
+        self._fetched_at = None
+
+    def reset(self):
+        """Bỏ spreadsheet / danh sách worksheet đã mở (lỗi xác thực, sheet bị đổi tên)."""
+        with self._lock:
+            self._spreadsheet = self._worksheets = None
+            self._fetched_at = None
+
+    def _open(self):
+        if self._worksheets is None:
+            self._spreadsheet = self.open_spreadsheet()
+            self._worksheets = {ws.index: ws for ws in self._spreadsheet.worksheets()}
+        return self._spreadsheet, self._worksheets
+
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and self._fetched_at is not None and self.clock() - self._fetched_at < self.max_age:
+                return
+            generation = self._generation
+            try:
+                spreadsheet, worksheets = self._open()
+                indexes = [i for i in (self.sheet_indexes or sorted(worksheets)) if i in worksheets]
+                response = spreadsheet.values_batch_get([a1_sheet(worksheets[i].title) for i in indexes])
+            except Exception:
+                self._spreadsheet = self._worksheets = None
+                raise
+            self.fetches += 1
+            for i, value_range in zip(indexes, response.get("valueRanges", [])):
+                values = value_range.get("values", [])
+                digest = values_digest(values)
+                if digest != self._digests.get(i):
+                    self._digests[i] = digest
+                    self._values[i] = values
+                    self._auto[i] = has_auto_rows(values)
+            if generation == self._generation:
+                self._fetched_at = self.clock()
+
+    def worksheet(self, index):
+        self.refresh()
+        with self._lock:
+            if self._worksheets is None or index not in self._worksheets:
+                raise KeyError(f"Không có worksheet index {index}")
+            return self._worksheets[index]
+
+    def values(self, index):
+        """Giá trị worksheet như get_all_values() (hàng cuối rỗng bị bỏ, hàng không đều dài)."""
+        self.refresh()
+        with self._lock:
+            return self._values.get(index, [])
+
+    def has_auto(self, index):
+        self.refresh()
+        with self._lock:
+            return self._auto.get(index, False)
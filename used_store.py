@@ -0,0 +1,102 @@
+import os
+import time
+import sqlite3
+import threading
+
+USED_DB = os.path.join("log_data", "used_videos.db")
+# khi dùng hết thư viện: chỉ giữ lại (không cho chọn) phần clip dùng gần đây nhất
+RECENT_FRACTION = 0.5
+
+
+class UsedVideoStore:
+    """Lưu các video đã dùng của một kênh trong SQLite (thay cho file log_data\\<Kênh>.log).
+
+    Mỗi path có thời điểm dùng gần nhất và số lần dùng; ghi ngay sau mỗi output thành công.
+    """
+
+    def __init__(self, channel, db_path=USED_DB, legacy_log=None):
+        self.channel = channel
+        if os.path.dirname(db_path):
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._lock = threading.Lock()
+        self.conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS used (
+                channel TEXT NOT NULL,
+                path TEXT NOT NULL,
+                last_used REAL NOT NULL,
+                use_count INTEGER NOT NULL DEFAULT 1,
+                PRIMARY KEY (channel, path)
+            )
+        """)
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_used_recent ON used(channel, last_used)")
+        self.conn.commit()
+        if legacy_log:
+            self.import_legacy(legacy_log)
+
+    def close(self):
+        self.conn.close()
+
+    def import_legacy(self, log_file):
+        """Nạp file log cũ (mỗi dòng một path) một lần, khi kênh chưa có dữ liệu trong DB."""
+        if not os.path.exists(log_file) or len(self):
+            return 0
+        with open(log_file, "r", encoding="utf-8") as f:
+            paths = [line.strip() for line in f if line.strip()]
+        # không biết thời điểm dùng thật: coi như dùng lúc file log được ghi lần cuối
+        self.mark_used(paths, ts=os.path.getmtime(log_file))
+        return len(paths)
+
+    def __len__(self):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT COUNT(*) FROM used WHERE channel = ?", (self.channel,)
+            ).fetchone()[0]
+
+    def __contains__(self, path):
+        with self._lock:
+            return self.conn.execute(
+                "SELECT 1 FROM used WHERE channel = ? AND path = ?", (self.channel, path)
+            ).fetchone() is not None
+
+    def paths(self):
+        with self._lock:
+            rows = self.conn.execute("SELECT path FROM used WHERE channel = ?", (self.channel,))
+            return {path for (path,) in rows}
+
+    def mark_used(self, paths, ts=None):
+        ts = time.time() if ts is None else ts
+        with self._lock:
+            self.conn.executemany(
+                """
+                INSERT INTO used (channel, path, last_used, use_count) VALUES (?, ?, ?, 1)
+                ON CONFLICT(channel, path) DO UPDATE SET
+                    last_used = MAX(last_used, excluded.last_used), use_count = use_count + 1
+                """,
+                [(self.channel, p, ts) for p in dict.fromkeys(paths)],
+            )
+            self.conn.commit()
+
+    def recent(self, limit):
+        """`limit` path dùng gần đây nhất."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path FROM used WHERE channel = ? ORDER BY last_used DESC LIMIT ?",
+                (self.channel, int(limit)),
+            )
+            return {path for (path,) in rows}
+
+    def least_recent(self, limit):
+        """`limit` path lâu chưa dùng nhất, cũ nhất trước."""
+        with self._lock:
+            rows = self.conn.execute(
+                "SELECT path FROM used WHERE channel = ? ORDER BY last_used ASC LIMIT ?",
+                (self.channel, int(limit)),
+            )
+            return [path for (path,) in rows]
+
+    def reuse_pool(self, file_paths, recent_fraction=RECENT_FRACTION):
+        """Các path được chọn lại khi đã dùng hết thư viện: trừ phần dùng gần đây nhất."""
+        blocked = self.recent(len(file_paths) * recent_fraction)
+        return [p for p in file_paths if p not in blocked]